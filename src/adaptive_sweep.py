@@ -0,0 +1,216 @@
+import json
+import logging
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from training import TrainingRun, canonical_parameters, row_parameters
+from state_encoding import STATE_ENCODINGS
+from convergence import ConvergenceMonitor
+from snapshot import load_snapshot, restore, save_snapshot, take_snapshot
+from sweep import SweepCheckpoint, row_seed_sequence, write_row_csv
+
+# Set up logging
+logger = logging.getLogger(__name__)
+stream_handler = logging.StreamHandler(sys.stdout)
+formatter = logging.Formatter('%(message)s')
+stream_handler.setFormatter(formatter)
+logger.addHandler(stream_handler)
+logger.setLevel(logging.INFO)
+
+
+def action_margin(qtables: list) -> float:
+    '''
+    Closeness of a grid cell to a decision boundary: the share of states in which the seeds disagree on the greedy
+    action, minus the smallest gap between the best and the second best action of any state, averaged over the seeds
+    and relative to the mean absolute q-value. Only states that some seed has learned a value for count
+    :param qtables: learned q-table of every seed of the cell
+    '''
+    q = np.stack(qtables)
+    learned = (q != 0).any(axis=(0, 2))
+    if not learned.any():
+        return 0.0
+    q = q[:, learned]
+    greedy = q.argmax(axis=-1)
+    disagreement = (greedy != greedy[0]).any(axis=0).mean()
+    best_two = np.sort(q, axis=-1)[..., -2:]
+    margin = (best_two[..., 1] - best_two[..., 0]).min(axis=1).mean()
+    return disagreement - margin / max(np.abs(q).mean(), 1e-12)
+
+
+def seed_variance(qtables: list) -> float:
+    '''
+    Largest standard deviation of a q-value between the seeds of a grid cell, relative to the mean absolute q-value
+    '''
+    q = np.stack(qtables)
+    return q.std(axis=0).max() / max(np.abs(q).mean(), 1e-12)
+
+
+# Scores of a grid cell by the name used in sweep specs. Cells with higher scores get more steps
+ADAPTIVE_METRICS = {'action_margin': action_margin, 'seed_variance': seed_variance}
+
+
+def rank_cells(cells: list, qtables: dict, score) -> list:
+    '''
+    :param cells: list of the rows of every cell
+    :param qtables: learned q-table of every row
+    :param score: function of the q-tables of a cell's rows, see ADAPTIVE_METRICS
+    :return: the cells from the highest to the lowest score
+    '''
+    return sorted(cells, key=lambda rows: score([qtables[row] for row in rows]), reverse=True)
+
+
+def rung_steps(n_runs: int, eta: int = 3, min_steps: int = None) -> list:
+    '''
+    :return: the number of steps every surviving row has taken after each rung, n_runs divided by powers of eta down to
+             at least min_steps. min_steps defaults to n_runs / eta ** 3
+    '''
+    min_steps = min_steps if min_steps is not None else max(n_runs // eta ** 3, 1)
+    n_rungs = int(math.log(n_runs / min_steps, eta) + 1e-9) + 1 if min_steps < n_runs else 1
+    return [n_runs // eta ** k for k in range(n_rungs - 1, -1, -1)]
+
+
+def _advance_row(row, grid_row, snapshot_path, target, n_runs, policy, decimation, convergence, state_encoding,
+                 learning, learning_options):
+    '''
+    Run one row up to step target, starting from the snapshot at snapshot_path if there is one, and save the run there.
+    Epsilon decays from its current value over the exploration time of target instead of n_runs, so the row is scored
+    after exploring. The targets of the rungs are recorded in parameters['adaptive_decay_targets']
+    :return: the row, its step count, whether it is finished and its q-table
+    '''
+    if not os.path.exists(snapshot_path):
+        parameters = row_parameters(grid_row)
+        run = TrainingRun(parameters, n_runs=n_runs, policy=policy, seed_sequence=row_seed_sequence(parameters),
+                          decimation=decimation,
+                          convergence=ConvergenceMonitor(**convergence) if convergence is not None else None,
+                          state_encoder=STATE_ENCODINGS[state_encoding](), learning=learning,
+                          learning_options=learning_options)
+    else:
+        run = restore(load_snapshot(snapshot_path))
+    run.decay_time = target * .7
+    run.decay_factor = run.agent.epsilon / max(run.decay_time - run.step_count, 1)
+    previous_targets = run.parameters.get('adaptive_decay_targets')
+    run.parameters['adaptive_decay_targets'] = f'{previous_targets},{target}' if previous_targets else str(target)
+    run.run(target - run.step_count)
+    save_snapshot(take_snapshot(run), snapshot_path)
+    return row, run.step_count, run.finished, run.agent.qtable.copy()
+
+
+def run_adaptive_sweep(grid: np.ndarray, folder_path: str, file_name: str, n_workers: int = None,
+                       n_runs: int = 60000, policy: str = 'epsilon_greedy', output_format: str = 'parquet',
+                       decimation: int = 1, convergence: dict = None, state_encoding: str = 'bin_low_high',
+                       learning: str = 'q_learning', learning_options: dict = None, metric: str = 'action_margin',
+                       eta: int = 3, min_steps: int = None):
+    '''
+    Successive halving over the cells of a grid, where a cell is a combination of parameters with all its SEEDs.
+
+    Every row first runs for min_steps steps, with epsilon decaying over that rung, so the rows have finished exploring
+    when the cells are scored on metric. Only the 1 / eta best scoring cells continue, for eta times as many steps,
+    until the remaining cells reach n_runs. Snapshots in <folder_path>/<file_name>_snapshots carry the runs from one
+    rung to the next, so continuing rows are not simulated again.
+
+    At every rung the decay of epsilon restarts from its current value over the exploration time of the rung's
+    target, so a row that reaches n_runs explored during the first rung, not during the first 70% of n_runs as in
+    sweep.run_sweep. Its learnedValue and RewardsCumMean are therefore not comparable with those of a plain sweep row.
+    parameters['adaptive_decay_targets'] lists the targets of the rungs a row ran, comma separated.
+
+    Rows that reach n_runs are written in the layout of sweep.run_sweep. Rows that stop early are written with the outputs they
+    have to <file_name>_pruned instead, a separate store or CSV prefix, and parameters['adaptive_steps'] holds the
+    number of steps they took. Rows written by an interrupted sweep are skipped when it is run again, and the others
+    start over from the first rung.
+    :param metric: name of the cell score in ADAPTIVE_METRICS
+    :param eta: factor by which the number of cells shrinks and the number of steps grows at every rung
+    :param min_steps: steps of the first rung, see rung_steps
+    Other arguments as in sweep.run_sweep
+    '''
+    if metric not in ADAPTIVE_METRICS:
+        raise ValueError(f'Unknown adaptive metric {metric}, expected one of {list(ADAPTIVE_METRICS)}')
+    if STATE_ENCODINGS[state_encoding].n_states is None:
+        raise ValueError('Adaptive sweeps need a state encoding with a fixed number of states')
+    score = ADAPTIVE_METRICS[metric]
+    os.makedirs(folder_path, exist_ok=True)
+    if output_format == 'parquet':
+        from result_store import ResultStore
+        store = ResultStore(os.path.join(folder_path, file_name + '.parquet'))
+        pruned_store = ResultStore(os.path.join(folder_path, file_name + '_pruned.parquet'))
+        store.consolidate()
+        pruned_store.consolidate()
+        finished = store.finished_rows() | pruned_store.finished_rows()
+    elif output_format == 'csv':
+        checkpoint = SweepCheckpoint(os.path.join(folder_path, file_name + '_checkpoint.txt'))
+        finished = checkpoint.finished
+    else:
+        raise ValueError(f'Unknown output format {output_format}')
+
+    snapshot_folder = os.path.join(folder_path, file_name + '_snapshots')
+    os.makedirs(snapshot_folder, exist_ok=True)
+
+    def snapshot_path(row):
+        return os.path.join(snapshot_folder, f'{row}.pkl')
+
+    def write(row, rung, pruned):
+        results = restore(load_snapshot(snapshot_path(row)), restore_random_state=False).results()
+        results['parameters']['adaptive_steps'] = step_counts[row]
+        results['parameters']['adaptive_rung'] = rung
+        if output_format == 'parquet':
+            (pruned_store if pruned else store).append(row, results)
+        else:
+            write_row_csv(results, folder_path, file_name + '_pruned' if pruned else file_name, row)
+            checkpoint.mark_finished(row)
+        os.remove(snapshot_path(row))
+
+    cells = {}
+    for row in range(len(grid)):
+        if row not in finished:
+            parameters = canonical_parameters(row_parameters(grid[row]))
+            del parameters['SEED']
+            cells.setdefault(json.dumps(parameters, sort_keys=True), []).append(row)
+    active = list(cells.values())
+    for row in [row for rows in active for row in rows]:
+        if os.path.exists(snapshot_path(row)):  # left behind by an interrupted sweep
+            os.remove(snapshot_path(row))
+    n_rows = sum(len(rows) for rows in active)
+    step_counts = {}
+    steps = rung_steps(n_runs, eta=eta, min_steps=min_steps)
+    simulated = 0
+    logger.info(f'{len(grid) - n_rows}/{len(grid)} rows already finished, {len(active)} cells in {len(steps)} rungs')
+
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            for rung, target in enumerate(steps):
+                futures = [executor.submit(_advance_row, row, grid[row], snapshot_path(row), target, n_runs, policy,
+                                           decimation, convergence, state_encoding, learning, learning_options)
+                           for rows in active for row in rows]
+                qtables, done = {}, set()
+                for future in as_completed(futures):
+                    row, step_count, row_finished, qtable = future.result()
+                    simulated += step_count - step_counts.get(row, 0)
+                    step_counts[row] = step_count
+                    qtables[row] = qtable
+                    if row_finished:
+                        write(row, rung, pruned=False)
+                        done.add(row)
+
+                active = [[row for row in rows if row not in done] for rows in active]
+                active = [rows for rows in active if rows]
+                if rung == len(steps) - 1:
+                    break
+                n_kept = math.ceil(len(active) / eta)
+                ranked = rank_cells(active, qtables, score)
+                for rows in ranked[n_kept:]:
+                    for row in rows:
+                        write(row, rung, pruned=True)
+                active = ranked[:n_kept]
+                logger.info(f'rung {rung}: {len(ranked)} cells at {target} steps, {len(active)} continue to '
+                            f'{steps[rung + 1]}')
+    finally:
+        if output_format == 'parquet':
+            store.consolidate()
+            pruned_store.consolidate()
+    if not os.listdir(snapshot_folder):
+        os.rmdir(snapshot_folder)
+    logger.info(f'{simulated} steps simulated, {simulated / max(n_runs * n_rows, 1):.1%} of a '
+                f'full sweep')
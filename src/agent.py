@@ -14,6 +14,32 @@ logger.addHandler(stream_handler)
 logger.setLevel(logging.INFO)
 
 
+def _choose_action(agent, q, policy, **kwargs):
+    '''
+    Pick an action from the q-values q of the current state, updating the UCB counters of agent
+    '''
+    if policy == 'softmax_q':  # Take actions according to probabilities assigned by softmax transformed q-values
+        action = random.choices(np.arange(agent.n_actions), weights=softmax(q))[0]
+    elif policy == 'epsilon_greedy':  # Epsilon-greedy policy
+        if np.random.rand(1)[0] > agent.epsilon:
+            action = np.random.choice(np.flatnonzero(q == q.max()))
+        else:
+            action = np.random.randint(0, agent.n_actions)
+    elif policy == 'ucb':  # Upper-confidence bound action selection, p35 sutton & barto
+        assert 'c' in kwargs.keys()
+        assert kwargs['c'] > 0
+        uncertainty = np.sqrt((np.log(agent.t / agent.action_history)))
+        ucb_actions = q + kwargs['c'] * uncertainty
+        logger.debug(ucb_actions)
+        action = np.argmax(ucb_actions)
+    else:
+        raise NotImplementedError()
+
+    agent.action_history[action] += 1
+    agent.t += 1
+    return action
+
+
 class QTableAgent:
     '''
     Tabular Q-learning agent
@@ -42,32 +68,267 @@ class QTableAgent:
         self.t = 0
         self.action_history = np.zeros(self.n_actions)
 
+        # Optional convergence.ConvergenceMonitor that observes every update
+        self.monitor = None
+
+    def attach_monitor(self, monitor):
+        self.monitor = monitor
+
+    @property
+    def converged(self):
+        return self.monitor is not None and self.monitor.converged
+
     def choose_action(self, state_id, policy, **kwargs):
+        return _choose_action(self, self.qtable[state_id, :], policy, **kwargs)
+
+    def update(self, state_id, next_state_id, action_id, reward):
+        '''
+        One-step Q-learning backup
+        :return: the change of the updated q-value, which is also the change of the sum of the q-table
+        '''
+        previous_q = self.qtable[state_id, action_id]
+        q = previous_q + self.alpha * (reward + self.gamma * np.max(self.qtable[next_state_id, :]) - previous_q)
+        self.qtable[state_id, action_id] = q
+        if self.monitor is not None:
+            self.monitor.observe(q - previous_q, self.qtable)
+        return q - previous_q
+
+
+class QLambdaAgent(QTableAgent):
+    '''
+    Watkins's Q(lambda), section 12.10 of Sutton and Barto
+    Every backup also updates the earlier state-actions of the episode, weighted by their eligibility traces, which
+    decay by gamma * lambda_ per step and are cut after an exploratory action.
+    '''
+
+    # Attributes besides the q-table that snapshots have to keep
+    LEARNING_STATE = ('traces',)
+
+    def __init__(self, n_states, n_actions, alpha, gamma, epsilon, lambda_=.8, replacing=True):
+        '''
+        :param replacing: set the trace of a visited state-action to 1 instead of adding 1 to it
+        '''
+        super().__init__(n_states, n_actions, alpha, gamma, epsilon)
+        self.lambda_ = lambda_
+        self.replacing = replacing
+        self.traces = np.zeros((n_states, n_actions))
+
+    def update(self, state_id, next_state_id, action_id, reward):
+        '''
+        Q(lambda) backup of every traced state-action
+        :return: the change of the sum of the q-table
+        '''
+        qtable, traces = self.qtable, self.traces
+        # action_id was chosen after the previous backup: the episode continues if it was greedy
+        if qtable[state_id, action_id] == qtable[state_id, :].max():
+            traces *= self.gamma * self.lambda_
+        else:
+            traces[:] = 0
+        if self.replacing:
+            traces[state_id, action_id] = 1
+        else:
+            traces[state_id, action_id] += 1
+        delta = reward + self.gamma * np.max(qtable[next_state_id, :]) - qtable[state_id, action_id]
+        change = self.alpha * delta * traces
+        qtable += change
+        q_delta = change.sum()
+        if self.monitor is not None:
+            self.monitor.observe(q_delta, qtable)
+        return q_delta
+
+
+class ReplayQTableAgent(QTableAgent):
+    '''
+    Q-learning with experience replay, or Dyna-Q planning with the stored transitions as the model, see chapter 8 of
+    Sutton and Barto.
+    Transitions are kept in a ring buffer of buffer_size records. Every replay_every updates, batch_size of them are
+    drawn and backed up in one vectorized step, in which every drawn state-action moves towards its mean target.
+    '''
+
+    LEARNING_STATE = ('states', 'actions', 'rewards', 'next_states', 'n_stored', 'n_updates', 'rng')
+
+    def __init__(self, n_states, n_actions, alpha, gamma, epsilon, buffer_size=10000, batch_size=32, replay_every=4,
+                 rng=None):
+        super().__init__(n_states, n_actions, alpha, gamma, epsilon)
+        self.batch_size = batch_size
+        self.replay_every = replay_every
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+        self.states = np.zeros(buffer_size, dtype=np.int32)
+        self.actions = np.zeros(buffer_size, dtype=np.int8)
+        self.rewards = np.zeros(buffer_size, dtype=np.float32)
+        self.next_states = np.zeros(buffer_size, dtype=np.int32)
+        self.n_stored = 0
+        self.n_updates = 0
+
+    def update(self, state_id, next_state_id, action_id, reward):
+        '''
+        One-step Q-learning backup, followed by a replayed batch every replay_every updates
+        :return: the change of the sum of the q-table
+        '''
+        qtable = self.qtable
+        previous_q = qtable[state_id, action_id]
+        q = previous_q + self.alpha * (reward + self.gamma * np.max(qtable[next_state_id, :]) - previous_q)
+        qtable[state_id, action_id] = q
+        q_delta = q - previous_q
+
+        i = self.n_updates % len(self.states)
+        self.states[i], self.actions[i], self.rewards[i], self.next_states[i] = (state_id, action_id, reward,
+                                                                                 next_state_id)
+        self.n_stored = min(self.n_stored + 1, len(self.states))
+        self.n_updates += 1
+        if self.n_updates % self.replay_every == 0 and self.n_stored >= self.batch_size:
+            q_delta += self.replay()
+
+        if self.monitor is not None:
+            self.monitor.observe(q_delta, qtable)
+        return q_delta
+
+    def replay(self):
+        '''
+        Back up a batch of stored transitions
+        :return: the change of the sum of the q-table
+        '''
+        batch = self.rng.integers(0, self.n_stored, self.batch_size)
+        cells = self.states[batch] * self.n_actions + self.actions[batch]
+        targets = self.rewards[batch] + self.gamma * self.qtable[self.next_states[batch], :].max(axis=1)
+        size = self.qtable.size
+        counts = np.bincount(cells, minlength=size)
+        visited = counts > 0
+        mean_targets = np.bincount(cells, weights=targets, minlength=size)[visited] / counts[visited]
+        q = self.qtable.reshape(-1)
+        change = self.alpha * (mean_targets - q[visited])
+        q[visited] += change
+        return change.sum()
+
+
+class SparseQTableAgent:
+    '''
+    Tabular Q-learning agent for states given as any hashable key, such as the tuples of state_encoding.AppraisalStates.
+
+    A state gets a row of the q-table on its first visit, through a dict from key to row, so memory grows with the
+    number of visited states instead of the size of the state space. qtable holds the rows of the visited states, in
+    the order of keys.
+    '''
 
-        if policy == 'softmax_q':  # Take actions according to probabilities assigned by softmax transformed q-values
-            action = random.choices(np.arange(self.n_actions), weights=softmax(self.qtable[state_id, :]))[0]
-        elif policy == 'epsilon_greedy':  # Epsilon-greedy policy
-            if np.random.rand(1)[0] > self.epsilon:
-                action = np.random.choice(np.flatnonzero(self.qtable[state_id, :] == self.qtable[state_id, :].max()))
-            else:
-                action = np.random.randint(0, self.n_actions)
-        elif policy == 'ucb':  # Upper-confidence bound action selection, p35 sutton & barto
+    def __init__(self, n_actions, alpha, gamma, epsilon, initial_capacity: int = 64):
+
+        self.n_actions = n_actions
+        self.keys = list()
+        self.rows = dict()
+        self._table = np.zeros((initial_capacity, n_actions))
+
+        self.alpha = alpha
+        self.gamma = gamma
+        self.epsilon = epsilon
+
+        # Used for Upper confidence bound policy (UCB)
+        self.t = 0
+        self.action_history = np.zeros(self.n_actions)
+
+        # Optional convergence.ConvergenceMonitor that observes every update
+        self.monitor = None
+
+    @property
+    def n_states(self):
+        return len(self.keys)
+
+    @property
+    def qtable(self):
+        return self._table[:len(self.keys)]
+
+    def attach_monitor(self, monitor):
+        self.monitor = monitor
+
+    @property
+    def converged(self):
+        return self.monitor is not None and self.monitor.converged
+
+    def row(self, state):
+        '''
+        :return: the q-table row of state, added on the first visit
+        '''
+        row = self.rows.get(state)
+        if row is None:
+            row = len(self.keys)
+            if row == len(self._table):
+                self._table = np.concatenate([self._table, np.zeros_like(self._table)])
+            self.rows[state] = row
+            self.keys.append(state)
+        return row
+
+    def choose_action(self, state, policy, **kwargs):
+        return _choose_action(self, self._table[self.row(state)], policy, **kwargs)
+
+    def update(self, state, next_state, action_id, reward):
+        '''
+        One-step Q-learning backup
+        :return: the change of the updated q-value
+        '''
+        row, next_row = self.row(state), self.row(next_state)
+        previous_q = self._table[row, action_id]
+        q = previous_q + self.alpha * (reward + self.gamma * np.max(self._table[next_row, :]) - previous_q)
+        self._table[row, action_id] = q
+        if self.monitor is not None:
+            self.monitor.observe(q - previous_q, self.qtable)
+        return q - previous_q
+
+
+class VectorQTableAgent:
+    '''
+    K independent tabular Q-learning agents updated in lockstep, one per environment of a VectorEmotionEnv.
+    Parameters can be scalars or arrays of shape (K,), so different parameter combinations share one batch.
+    '''
+
+    def __init__(self, n_envs, n_states, n_actions, alpha, gamma, epsilon, rng=None):
+
+        self.n_envs = n_envs
+        self.n_states = n_states
+        self.n_actions = n_actions
+
+        # Initialize q-tables with zeros
+        self.qtable = np.zeros((n_envs, n_states, n_actions))
+
+        self.alpha = np.broadcast_to(np.asarray(alpha, dtype=float), (n_envs,)).copy()
+        self.gamma = np.broadcast_to(np.asarray(gamma, dtype=float), (n_envs,)).copy()
+        self.epsilon = np.broadcast_to(np.asarray(epsilon, dtype=float), (n_envs,)).copy()
+
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self._rows = np.arange(n_envs)
+
+        # Used for Upper confidence bound policy (UCB)
+        self.t = 0
+        self.action_history = np.zeros((n_envs, n_actions))
+
+    def choose_action(self, state_ids, policy, **kwargs):
+        q = self.qtable[self._rows, state_ids, :]
+
+        if policy == 'softmax_q':
+            weights = softmax(q, axis=1)
+            cumulative = np.cumsum(weights, axis=1)
+            draws = self.rng.random(self.n_envs) * cumulative[:, -1]
+            actions = np.minimum((cumulative < draws[:, None]).sum(axis=1), self.n_actions - 1)
+        elif policy == 'epsilon_greedy':
+            # Break ties between maximal actions uniformly at random
+            is_max = q == q.max(axis=1, keepdims=True)
+            ranks = np.cumsum(is_max, axis=1)
+            picks = np.floor(self.rng.random(self.n_envs) * ranks[:, -1]).astype(int) + 1
+            greedy = np.argmax(is_max & (ranks == picks[:, None]), axis=1)
+            explore = self.rng.random(self.n_envs) <= self.epsilon
+            actions = np.where(explore, self.rng.integers(0, self.n_actions, self.n_envs), greedy)
+        elif policy == 'ucb':
             assert 'c' in kwargs.keys()
             assert kwargs['c'] > 0
             uncertainty = np.sqrt((np.log(self.t / self.action_history)))
-            ucb_actions = self.qtable[state_id, :] + kwargs['c'] * uncertainty
-            logger.debug(ucb_actions)
-            action = np.argmax(ucb_actions)
+            actions = np.argmax(q + kwargs['c'] * uncertainty, axis=1)
         else:
             raise NotImplementedError()
 
-        self.action_history[action] += 1
+        self.action_history[self._rows, actions] += 1
         self.t += 1
-        return action
-
-    def update(self, state_id, next_state_id, action_id, reward):
-        q = self.qtable[state_id, action_id] + self.alpha * (reward + self.gamma * np.max(self.qtable[next_state_id, :]) - self.qtable[state_id, action_id])
-        self.qtable[state_id, action_id] = q
-
-
+        return actions
 
+    def update(self, state_ids, next_state_ids, action_ids, rewards):
+        current = self.qtable[self._rows, state_ids, action_ids]
+        target = rewards + self.gamma * self.qtable[self._rows, next_state_ids, :].max(axis=1)
+        self.qtable[self._rows, state_ids, action_ids] = current + self.alpha * (target - current)
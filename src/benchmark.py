@@ -0,0 +1,266 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from environment import AgentStatus, EmotionEnv
+from agent import QTableAgent
+from training import LEARNING_MODES, N_ACTIONS, N_STATES, TrainingRun, make_stimuli
+from convergence import ConvergenceMonitor
+from fast_path import run_fast
+
+PARAMETERS = {'N_STIMULI': 300, 'STIMULUS_MAX_OCCURRENCE': 5, 'alpha': .1, 'gamma': .99, 'epsilon': 1,
+              'disengage_benefit': 2, 'engage_benefit': 2, 'engage_adaptation': 2, 'SEED': 123,
+              'PERCENTAGE_RESOLVABLE_STIMULI': .5}
+
+
+def _latencies(call, n_calls, prepare=None):
+    '''
+    :param prepare: function called before every call, outside the timing
+    :return: wall-clock time of each of n_calls calls in seconds
+    '''
+    timings = np.empty(n_calls)
+    clock = time.perf_counter_ns
+    for i in range(n_calls):
+        if prepare is not None:
+            prepare()
+        start = clock()
+        call()
+        timings[i] = clock() - start
+    return timings * 1e-9
+
+
+def _peak_memory(setup, call, n_calls):
+    '''
+    :return: peak traced memory in bytes of setting up and making n_calls calls
+    '''
+    tracemalloc.start()
+    state = setup()
+    for _ in range(n_calls):
+        call(state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def _result(name, size, timings, peak_memory, **extra):
+    total = timings.sum()
+    return dict({'name': name, 'size': size, 'calls': len(timings), 'calls_per_sec': len(timings) / total,
+                 'p50_us': np.percentile(timings, 50) * 1e6, 'p90_us': np.percentile(timings, 90) * 1e6,
+                 'p99_us': np.percentile(timings, 99) * 1e6, 'max_us': timings.max() * 1e6,
+                 'peak_memory_bytes': peak_memory}, **extra)
+
+
+def _make_env(n_stimuli, seed=PARAMETERS['SEED']):
+    np.random.seed(seed)
+    stimuli = make_stimuli(n_stimuli, PARAMETERS['PERCENTAGE_RESOLVABLE_STIMULI'])
+    env = EmotionEnv(engage_benefit=PARAMETERS['engage_benefit'],
+                     disengage_benefit=PARAMETERS['disengage_benefit'],
+                     engage_adaptation=PARAMETERS['engage_adaptation'],
+                     stimulus_max_occurrence=PARAMETERS['STIMULUS_MAX_OCCURRENCE'],
+                     stimuli=stimuli,
+                     agent_status=AgentStatus(),
+                     rng=np.random.default_rng(seed))
+    env.reset()
+    return env
+
+
+def _force_refresh(env):
+    '''
+    Replace the current stimulus. Its appraisal is only retired at the next appraisal, so reset env between calls
+    '''
+    env.agent_status.current_encounter_counter = env.stimulus_max_occurrence
+    env.refresh_stimuli_list()
+
+
+def _reset_and_refresh(env):
+    env.reset()
+    _force_refresh(env)
+
+
+def bench_env(n_stimuli, n_calls):
+    '''
+    EmotionEnv.step, reset and refresh_stimuli_list for one number of stimuli. refresh_stimuli_list is timed with a
+    replacement on every call, its most expensive branch, after an untimed reset that retires the previous replacement
+    as a step would.
+    '''
+    actions = np.random.default_rng(0).integers(0, N_ACTIONS, n_calls).tolist()
+    results = []
+
+    env = _make_env(n_stimuli)
+    step_actions = iter(actions)
+    timings = _latencies(lambda: env.step(next(step_actions)), n_calls)
+    peak = _peak_memory(lambda: (_make_env(n_stimuli), iter(actions)),
+                        lambda state: state[0].step(next(state[1])), n_calls)
+    results.append(_result('EmotionEnv.step', n_stimuli, timings, peak))
+
+    env = _make_env(n_stimuli)
+    timings = _latencies(env.reset, n_calls)
+    peak = _peak_memory(lambda: _make_env(n_stimuli), lambda state: state.reset(), n_calls)
+    results.append(_result('EmotionEnv.reset', n_stimuli, timings, peak))
+
+    env = _make_env(n_stimuli)
+    timings = _latencies(lambda: _force_refresh(env), n_calls, prepare=env.reset)
+    peak = _peak_memory(lambda: _make_env(n_stimuli), _reset_and_refresh, n_calls)
+    results.append(_result('EmotionEnv.refresh_stimuli_list', n_stimuli, timings, peak))
+    return results
+
+
+def bench_agent(n_calls):
+    '''
+    QTableAgent.choose_action for every policy and QTableAgent.update
+    '''
+    rng = np.random.default_rng(0)
+    states = rng.integers(0, N_STATES, n_calls + 1).tolist()
+    actions = rng.integers(0, N_ACTIONS, n_calls).tolist()
+    rewards = rng.uniform(0, 10, n_calls).tolist()
+
+    def make_agent():
+        agent = QTableAgent(N_STATES, n_actions=N_ACTIONS, alpha=.1, gamma=.99, epsilon=.1)
+        agent.qtable = rng.uniform(0, 1, (N_STATES, N_ACTIONS))
+        # UCB needs every action to have been taken once
+        agent.action_history[:] = 1
+        agent.t = N_ACTIONS
+        return agent
+
+    results = []
+    for policy, kwargs in (('softmax_q', {}), ('epsilon_greedy', {}), ('ucb', {'c': 1})):
+        agent = make_agent()
+        state_iter = iter(states)
+        timings = _latencies(lambda: agent.choose_action(next(state_iter), policy=policy, **kwargs), n_calls)
+        peak = _peak_memory(lambda: (make_agent(), iter(states)),
+                            lambda state: state[0].choose_action(next(state[1]), policy=policy, **kwargs), n_calls)
+        results.append(_result('QTableAgent.choose_action', N_STATES, timings, peak, policy=policy))
+
+    def update(state):
+        agent, index = state
+        i = next(index)
+        agent.update(states[i], states[i + 1], actions[i], rewards[i])
+
+    update_state = (make_agent(), iter(range(n_calls)))
+    timings = _latencies(lambda: update(update_state), n_calls)
+    peak = _peak_memory(lambda: (make_agent(), iter(range(n_calls))), update, n_calls)
+    results.append(_result('QTableAgent.update', N_STATES, timings, peak))
+    return results
+
+
+def bench_training(n_runs, n_stimuli, fast=False):
+    '''
+    Training of one grid row, as steps per second. The TrainingRun is built before the timing, so only its steps are
+    timed. run_fast is timed as a whole, including the generation of its stimuli. The peak memory includes building the
+    run
+    '''
+    parameters = dict(PARAMETERS, N_STIMULI=n_stimuli)
+    if fast:
+        run_fast(parameters, n_runs=min(n_runs, 1000))  # compile outside the timing
+        call = lambda: run_fast(parameters, n_runs=n_runs)
+        start = time.perf_counter()
+        call()
+    else:
+        def call():
+            TrainingRun(parameters, n_runs=n_runs).run()
+        run = TrainingRun(parameters, n_runs=n_runs)
+        start = time.perf_counter()
+        run.run()
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    call()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'name': 'run_fast' if fast else 'TrainingRun.run', 'size': n_runs, 'n_stimuli': n_stimuli,
+            'seconds': seconds, 'steps_per_sec': n_runs / seconds, 'peak_memory_bytes': peak}
+
+
+def bench_learning(n_runs, learning):
+    '''
+    Training with one learning mode until convergence, as environment steps to convergence and steps per second
+    '''
+    run = TrainingRun(PARAMETERS, n_runs=n_runs, convergence=ConvergenceMonitor(window=2000),
+                      learning=learning)
+    start = time.perf_counter()
+    run.run()
+    seconds = time.perf_counter() - start
+    return {'name': 'TrainingRun.run', 'size': n_runs, 'learning': learning, 'seconds': seconds,
+            'steps': run.step_count, 'steps_per_sec': run.step_count / seconds,
+            'converged_step': run.agent.monitor.converged_step if run.agent.converged else -1}
+
+
+def compare(results, baseline, threshold):
+    '''
+    :return: benchmarks whose throughput dropped below baseline / threshold
+    '''
+    def key(result):
+        return result['name'], result['size'], result.get('policy'), result.get('n_stimuli'), result.get('learning')
+
+    def throughput(result):
+        return result.get('calls_per_sec', result.get('steps_per_sec'))
+
+    previous = {key(result): throughput(result) for result in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get(key(result))
+        if old is not None and throughput(result) * threshold < old:
+            regressions.append({'benchmark': key(result), 'baseline': old, 'current': throughput(result)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the environment, the agent and end-to-end training')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000],
+                        help='numbers of stimuli for the environment benchmarks')
+    parser.add_argument('--runs', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='run lengths for the end-to-end benchmarks')
+    parser.add_argument('--fast-runs', type=int, nargs='+', default=[1000, 100000, 1000000],
+                        help='run lengths for the fast path benchmarks')
+    parser.add_argument('--learning-runs', type=int, default=100000,
+                        help='maximum run length of the learning mode benchmarks, which stop at convergence')
+    parser.add_argument('--calls', type=int, default=10000, help='calls per micro benchmark')
+    parser.add_argument('--out', default=None, help='write the results as JSON to this file')
+    parser.add_argument('--compare', default=None, help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='report a regression when throughput drops by more than this factor')
+    args = parser.parse_args()
+
+    results = []
+    for n_stimuli in args.sizes:
+        results += bench_env(n_stimuli, args.calls)
+    results += bench_agent(args.calls)
+    for n_runs in args.runs:
+        results.append(bench_training(n_runs, PARAMETERS['N_STIMULI']))
+    for n_runs in args.fast_runs:
+        results.append(bench_training(n_runs, PARAMETERS['N_STIMULI'], fast=True))
+    for learning in LEARNING_MODES:
+        results.append(bench_learning(args.learning_runs, learning))
+
+    for result in results:
+        if 'calls_per_sec' in result:
+            print(f"{result['name']:<34}{result.get('policy', ''):<16}size={result['size']:<8}"
+                  f"{result['calls_per_sec']:>12.0f}/s  p50={result['p50_us']:.1f}us  p99={result['p99_us']:.1f}us")
+        elif 'learning' in result:
+            print(f"{result['name']:<34}{result['learning']:<16}runs={result['size']:<8}"
+                  f"{result['steps_per_sec']:>12.0f} steps/s  converged at step {result['converged_step']}")
+        else:
+            print(f"{result['name']:<34}{'':<16}runs={result['size']:<8}{result['steps_per_sec']:>12.0f} steps/s  "
+                  f"peak={result['peak_memory_bytes'] / 1e6:.1f}MB")
+
+    report = {'python': sys.version, 'platform': platform.platform(), 'numpy': np.__version__,
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2, default=float)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
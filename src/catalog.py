@@ -0,0 +1,217 @@
+import argparse
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from training import ACTION_NAMES
+
+CATALOG_NAME = 'catalog.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, sweep TEXT NOT NULL, row TEXT NOT NULL, kind TEXT NOT NULL,
+                                  size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS files_sweep_kind ON files (sweep, kind);
+CREATE TABLE IF NOT EXISTS parameters (sweep TEXT NOT NULL, row TEXT NOT NULL, name TEXT NOT NULL, value,
+                                       PRIMARY KEY (sweep, row, name));
+CREATE INDEX IF NOT EXISTS parameters_name_value ON parameters (name, value);
+'''
+
+
+def parse_file_name(sweep: str, file_name: str):
+    '''
+    Split <sweep>_<row>_<kind>.csv. The row is a grid row number, or the parameter value of older one-parameter sweeps
+    such as alpha_0.001_RewardsCumMean.csv
+    :return: row and kind, or None for other files
+    '''
+    if not file_name.endswith('.csv') or not file_name.startswith(sweep + '_'):
+        return None
+    row, separator, kind = file_name[len(sweep) + 1:-len('.csv')].rpartition('_')
+    if not separator or not row:
+        return None
+    return row, kind
+
+
+def _number(value: str):
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+
+def read_parameters_csv(path: str) -> dict:
+    '''
+    Parameters of a <sweep>_<row>_parameters.csv file, with stray colons removed from the names
+    '''
+    with open(path) as f:
+        names = f.readline().rstrip('\n').split(',')
+        values = f.readline().rstrip('\n').split(',')
+    return {name.strip().rstrip(':'): _number(value.strip()) for name, value in zip(names[1:], values[1:])}
+
+
+def _read_output(path: str):
+    import pyarrow as pa
+    import pyarrow.csv as csv
+    return csv.read_csv(path, convert_options=csv.ConvertOptions(
+        include_columns=list(ACTION_NAMES), column_types={action: pa.float64() for action in ACTION_NAMES}))
+
+
+class Catalog:
+    '''
+    Persistent index of the CSV outputs under a datasets folder, kept in an SQLite file.
+
+    Every <sweep>/<sweep>_<row>_<kind>.csv file is listed with its sweep, row and output kind, and the parameters of
+    every <sweep>_<row>_parameters.csv file are stored one per record. update() only re-reads files whose size or
+    modification time changed. query() selects outputs by sweep, kind and parameter values in SQL and reads only the
+    matching files.
+    '''
+
+    def __init__(self, root: str = os.path.join('..', 'datasets'), path: str = None):
+        self.root = root
+        self.path = path if path is not None else os.path.join(root, CATALOG_NAME)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def update(self) -> dict:
+        '''
+        Bring the catalog in line with the files under root
+        :return: number of files added, changed and removed
+        '''
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in
+                 self.connection.execute('SELECT path, size, mtime_ns FROM files')}
+        counts = {'added': 0, 'changed': 0, 'removed': 0}
+        seen = set()
+        with self.connection:
+            for folder in sorted(os.scandir(self.root), key=lambda entry: entry.name):
+                if not folder.is_dir():
+                    continue
+                sweep = folder.name
+                for entry in os.scandir(folder.path):
+                    parsed = parse_file_name(sweep, entry.name)
+                    if parsed is None:
+                        continue
+                    path = os.path.relpath(entry.path, self.root)
+                    seen.add(path)
+                    stat = entry.stat()
+                    if known.get(path) == (stat.st_size, stat.st_mtime_ns):
+                        continue
+                    counts['changed' if path in known else 'added'] += 1
+                    row, kind = parsed
+                    self.connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                                            (path, sweep, row, kind, stat.st_size, stat.st_mtime_ns))
+                    if kind == 'parameters':
+                        self.connection.execute('DELETE FROM parameters WHERE sweep = ? AND row = ?', (sweep, row))
+                        self.connection.executemany('INSERT INTO parameters VALUES (?, ?, ?, ?)',
+                                                    [(sweep, row, name, value) for name, value in
+                                                     read_parameters_csv(entry.path).items()])
+            for path in set(known) - seen:
+                sweep, row, kind = self.connection.execute('SELECT sweep, row, kind FROM files WHERE path = ?',
+                                                           (path,)).fetchone()
+                self.connection.execute('DELETE FROM files WHERE path = ?', (path,))
+                if kind == 'parameters':
+                    self.connection.execute('DELETE FROM parameters WHERE sweep = ? AND row = ?', (sweep, row))
+                counts['removed'] += 1
+        return counts
+
+    def sweeps(self) -> list:
+        return [sweep for sweep, in self.connection.execute('SELECT DISTINCT sweep FROM files ORDER BY sweep')]
+
+    def kinds(self, sweep: str = None) -> list:
+        if sweep is None:
+            return [kind for kind, in self.connection.execute('SELECT DISTINCT kind FROM files ORDER BY kind')]
+        return [kind for kind, in self.connection.execute('SELECT DISTINCT kind FROM files WHERE sweep = ? ORDER BY kind',
+                                                          (sweep,))]
+
+    def find(self, kinds: list = None, sweeps: list = None, rows: list = None, where: dict = None) -> list:
+        '''
+        :param where: dict of parameter name to a value or a list of accepted values
+        :return: path, sweep, row and kind of every matching output file
+        '''
+        conditions, arguments = [], []
+        for column, values in (('kind', kinds), ('sweep', sweeps), ('row', rows)):
+            if values is not None:
+                values = [str(value) for value in values] if column == 'row' else list(values)
+                conditions.append(f'f.{column} IN ({", ".join("?" * len(values))})')
+                arguments += values
+        if kinds is None:
+            conditions.append("f.kind != 'parameters'")
+        for name, values in (where or {}).items():
+            values = list(values) if isinstance(values, (list, tuple, set)) else [values]
+            conditions.append('EXISTS (SELECT 1 FROM parameters p WHERE p.sweep = f.sweep AND p.row = f.row '
+                              f'AND p.name = ? AND p.value IN ({", ".join("?" * len(values))}))')
+            arguments += [name] + values
+        sql = 'SELECT f.path, f.sweep, f.row, f.kind FROM files f'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        return self.connection.execute(sql + ' ORDER BY f.sweep, f.row, f.kind', arguments).fetchall()
+
+    def parameters(self, sweeps: list = None):
+        '''
+        :return: pandas DataFrame with one record per sweep and row and one column per parameter
+        '''
+        import pandas as pd
+        sql = 'SELECT sweep, row, name, value FROM parameters'
+        arguments = []
+        if sweeps is not None:
+            sql += f' WHERE sweep IN ({", ".join("?" * len(sweeps))})'
+            arguments = list(sweeps)
+        records = pd.DataFrame(self.connection.execute(sql, arguments).fetchall(),
+                               columns=['sweep', 'row', 'name', 'value'])
+        return records.pivot(index=['sweep', 'row'], columns='name', values='value').reset_index()
+
+    def query(self, kinds: list = None, sweeps: list = None, rows: list = None, where: dict = None,
+              with_parameters: bool = True, n_threads: int = 8):
+        '''
+        Load the matching outputs into one long format pandas DataFrame with the columns sweep, row, kind, index (the
+        line within the output), one column per action and, with_parameters, one column per parameter.
+        Arguments as in find. Files are parsed in parallel threads and combined in one step.
+        '''
+        import numpy as np
+        import pyarrow as pa
+
+        matches = self.find(kinds=kinds, sweeps=sweeps, rows=rows, where=where)
+        if not matches:
+            raise LookupError('No outputs match the query')
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            tables = list(executor.map(_read_output, [os.path.join(self.root, path) for path, _, _, _ in matches]))
+        lengths = [table.num_rows for table in tables]
+        values = pa.concat_tables(tables)
+        columns = {'sweep': pa.array(np.repeat([sweep for _, sweep, _, _ in matches], lengths)).dictionary_encode(),
+                   'row': pa.array(np.repeat([row for _, _, row, _ in matches], lengths)),
+                   'kind': pa.array(np.repeat([kind for _, _, _, kind in matches], lengths)).dictionary_encode(),
+                   'index': pa.array(np.concatenate([np.arange(length) for length in lengths]))}
+        for action in ACTION_NAMES:
+            columns[action] = values.column(action)
+        frame = pa.table(columns).to_pandas()
+        if with_parameters:
+            parameters = self.parameters(sweeps=sorted({sweep for _, sweep, _, _ in matches}))
+            if len(parameters):
+                frame['sweep'] = frame['sweep'].astype(str)
+                frame = frame.merge(parameters, on=['sweep', 'row'], how='left')
+        return frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Index the CSV outputs under a datasets folder')
+    parser.add_argument('--root', default=os.path.join('..', 'datasets'))
+    parser.add_argument('--catalog', default=None, help=f'catalog file, defaults to <root>/{CATALOG_NAME}')
+    args = parser.parse_args()
+    with Catalog(args.root, path=args.catalog) as catalog:
+        counts = catalog.update()
+        print(f"{counts['added']} added, {counts['changed']} changed, {counts['removed']} removed, "
+              f"{len(catalog.sweeps())} sweeps in {catalog.path}")
+
+
+if __name__ == '__main__':
+    main()
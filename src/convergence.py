@@ -0,0 +1,86 @@
+from collections import deque
+
+import numpy as np
+
+
+class ConvergenceMonitor:
+    '''
+    Decides when a Q-learning run has stopped changing.
+
+    With a constant learning rate every update keeps moving a q-value by about alpha times its TD error, so the monitor
+    looks at the net drift of the q-table instead. Every check_every updates it samples the q-table, and it compares the
+    mean of the samples of the last `window` updates with the mean of the `window` updates before them. A run has
+    converged once, after at least min_steps updates, the largest difference between the two means is at most
+    q_tolerance relative to the mean absolute q-value, and both means have the same greedy action in every state whose
+    best action leads the second best by more than that tolerance. States with a smaller lead are ties within the noise
+    of the q-values.
+
+    min_steps defaults to the end of the epsilon decay of the training.TrainingRun the monitor is given to, so a run does
+    not converge while it is still exploring.
+    '''
+
+    def __init__(self, window: int = 5000, q_tolerance: float = .02, min_steps: int = None, check_every: int = 100):
+        self.window = window
+        self.q_tolerance = q_tolerance
+        self.min_steps = min_steps
+        self.check_every = check_every
+
+        self.step = 0
+        self.converged_step = None
+        self._samples_per_window = max(window // check_every, 1)
+        self._samples = deque(maxlen=2 * self._samples_per_window)
+
+    @property
+    def converged(self) -> bool:
+        return self.converged_step is not None
+
+    def _window_means(self):
+        '''
+        :return: the mean sampled q-table of the window before the last and of the last window, or None before two
+                 windows were sampled. States that were not in the q-table yet count as 0
+        '''
+        if len(self._samples) < self._samples.maxlen:
+            return None
+        samples = np.zeros((len(self._samples),) + self._samples[-1].shape)
+        for i, sample in enumerate(self._samples):
+            samples[i, :len(sample)] = sample
+        return samples[:self._samples_per_window].mean(axis=0), samples[self._samples_per_window:].mean(axis=0)
+
+    def drift(self):
+        '''
+        :return: largest difference between the mean q-tables of the last two windows, relative to the mean absolute
+                 q-value, or None before two windows were sampled
+        '''
+        means = self._window_means()
+        if means is None:
+            return None
+        earlier, recent = means
+        return np.abs(recent - earlier).max() / max(np.abs(recent).mean(), 1e-12)
+
+    def observe(self, q_delta: float, qtable: np.ndarray) -> bool:
+        '''
+        Record one update of the q-table
+        :param q_delta: change of the q-table by the update, unused
+        :return: whether the run has converged
+        '''
+        self.step += 1
+        if self.converged or self.step % self.check_every:
+            return self.converged
+
+        self._samples.append(qtable.copy())
+        if self.step < max(self.min_steps or 0, 2 * self.window):
+            return False
+        means = self._window_means()
+        if means is None:
+            return False
+        earlier, recent = means
+        scale = max(np.abs(recent).mean(), 1e-12)
+        best_two = np.sort(recent, axis=-1)[:, -2:]
+        decided = best_two[:, 1] - best_two[:, 0] > self.q_tolerance * scale
+        same_policy = (recent.argmax(axis=-1) == earlier.argmax(axis=-1))[decided].all()
+        if np.abs(recent - earlier).max() <= self.q_tolerance * scale and same_policy:
+            self.converged_step = self.step
+        return self.converged
+
+    def summary(self) -> dict:
+        return {'converged_step': self.converged_step, 'q_drift': self.drift()}
@@ -1,6 +1,6 @@
 import numpy as np
 import random
-import copy
+from array import array
 
 import gym
 from gym.spaces import Discrete, Tuple, Box, Dict
@@ -28,39 +28,345 @@ class Stimulus:
                 'encounters': self.encounter_counter, 'resolvable': self.resolvable}
 
 
+class StimulusView:
+    '''
+    The attribute API of Stimulus on one row of a StimulusTable. Reads and writes go to the table's columns.
+    '''
+
+    __slots__ = ('table', 'slot')
+
+    def __init__(self, table, slot: int):
+        self.table = table
+        self.slot = slot
+
+    def _column(name):
+        def get(self):
+            return getattr(self.table, name)[self.slot]
+
+        def set(self, value):
+            getattr(self.table, name)[self.slot] = value
+        return property(get, set)
+
+    id = property(lambda self: int(self.table.id[self.slot]))
+    emo_intensity = _column('emo_intensity')
+    p_occurrence = _column('p_occurrence')
+    resolvable = property(lambda self: bool(self.table.resolvable[self.slot]))
+    encounter_counter = _column('encounter_counter')
+    reappraisal_counter = _column('reappraisal_counter')
+    del _column
+
+    def get_intensity(self):
+        return self.emo_intensity
+
+    def get_p_occurrence(self):
+        return self.p_occurrence
+
+    def get_dict(self):
+        return {'id': self.id, 'emo_intensity': float(self.emo_intensity), "p_occurrence": float(self.p_occurrence),
+                'reappraisals': int(self.reappraisal_counter),
+                'encounters': int(self.encounter_counter), 'resolvable': self.resolvable}
+
+
+class StimulusTable:
+    '''
+    Stimuli as typed numpy columns with one row (slot) per stimulus and an index from stimulus id to slot.
+
+    Removed stimuli leave a free slot with id -1 that the next add reuses, and the columns grow by doubling, so adding
+    and removing stimuli does not allocate per stimulus. Indexing with a slot or iterating gives StimulusView objects.
+    '''
+
+    COLUMNS = (('id', np.int64), ('emo_intensity', np.float64), ('p_occurrence', np.float64), ('resolvable', np.bool_),
+               ('encounter_counter', np.int64), ('reappraisal_counter', np.int64))
+
+    def __init__(self, capacity: int = 16):
+        for name, dtype in self.COLUMNS:
+            setattr(self, name, np.zeros(max(capacity, 1), dtype=dtype))
+        self.id[:] = -1
+        self.size = 0  # slots below size are used or free
+        self._index = dict()
+        self._free = list()
+
+    @classmethod
+    def from_stimuli(cls, stimuli):
+        table = cls(capacity=len(stimuli))
+        for stimulus in stimuli:
+            table.add(stimulus.id, stimulus.emo_intensity, np.asarray(stimulus.p_occurrence).item(),
+                      stimulus.resolvable, stimulus.encounter_counter, stimulus.reappraisal_counter)
+        return table
+
+    @classmethod
+    def from_columns(cls, columns: dict):
+        '''
+        :param columns: dict with an array for every name in COLUMNS, one entry per stimulus
+        '''
+        table = cls(capacity=len(columns['id']))
+        table.size = len(columns['id'])
+        for name, dtype in cls.COLUMNS:
+            getattr(table, name)[:table.size] = columns[name]
+        table._index = {int(stimulus_id): slot for slot, stimulus_id in enumerate(columns['id'])}
+        return table
+
+    def columns(self) -> dict:
+        '''
+        :return: copies of the columns of all stimuli, in slot order
+        '''
+        slots = self.slots()
+        return {name: getattr(self, name)[slots] for name, _ in self.COLUMNS}
+
+    def slots(self) -> np.ndarray:
+        return np.flatnonzero(self.id[:self.size] >= 0)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, stimulus_id):
+        return stimulus_id in self._index
+
+    def __iter__(self):
+        return (StimulusView(self, slot) for slot in self.slots())
+
+    def __getitem__(self, slot):
+        return StimulusView(self, slot)
+
+    def slot_of(self, stimulus_id):
+        return self._index.get(stimulus_id)
+
+    def add(self, stimulus_id, emo_intensity, p_occurrence, resolvable, encounter_counter=0, reappraisal_counter=0):
+        '''
+        :return: the slot of the new stimulus
+        '''
+        if self._free:
+            slot = self._free.pop()
+        else:
+            if self.size == len(self.id):
+                self._grow()
+            slot = self.size
+            self.size += 1
+        self.id[slot] = stimulus_id
+        self.emo_intensity[slot] = emo_intensity
+        self.p_occurrence[slot] = p_occurrence
+        self.resolvable[slot] = resolvable
+        self.encounter_counter[slot] = encounter_counter
+        self.reappraisal_counter[slot] = reappraisal_counter
+        self._index[stimulus_id] = slot
+        return slot
+
+    def copy_row(self, source, row: int):
+        '''
+        Add a copy of row of the StimulusTable source
+        :return: the slot of the copy
+        '''
+        return self.add(int(source.id[row]), source.emo_intensity[row], source.p_occurrence[row], source.resolvable[row],
+                        source.encounter_counter[row], source.reappraisal_counter[row])
+
+    def remove(self, stimulus_id):
+        slot = self._index.pop(stimulus_id)
+        self.id[slot] = -1
+        self._free.append(slot)
+        return slot
+
+    def rekey(self, slot: int, stimulus_id):
+        '''
+        Replace the stimulus in slot by a new one with the same intensity, probability of occurrence and resolvability
+        '''
+        del self._index[int(self.id[slot])]
+        self.id[slot] = stimulus_id
+        self.encounter_counter[slot] = 0
+        self.reappraisal_counter[slot] = 0
+        self._index[stimulus_id] = slot
+
+    def _grow(self):
+        for name, _ in self.COLUMNS:
+            column = getattr(self, name)
+            grown = np.zeros(2 * len(column), dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+        self.id[self.size:] = -1
+
+
+class AppraisalStore:
+    '''
+    Appraisals of the stimuli an agent has encountered, as rows of a StimulusTable keyed by stimulus id.
+
+    Appraisals of replaced stimuli are retired: they are removed from the store and folded into aggregate counters, so
+    memory stays bounded by the number of live stimuli. With keep_retired, a compact record of every retired appraisal
+    (id, emo_intensity, encounters, reappraisals, resolvable) is kept in typed arrays for analysis.
+    '''
+
+    def __init__(self, keep_retired: bool = False):
+        self.table = StimulusTable()
+        self.keep_retired = keep_retired
+        self.n_retired = 0
+        self.retired_encounters = 0
+        self.retired_reappraisals = 0
+        self.retired_resolvable = 0
+        self._retired_records = {'id': array('q'), 'emo_intensity': array('d'), 'encounters': array('q'),
+                                 'reappraisals': array('q'), 'resolvable': array('b')}
+
+    def __len__(self):
+        return len(self.table)
+
+    def __contains__(self, stimulus_id):
+        return stimulus_id in self.table
+
+    def __iter__(self):
+        return iter(self.table)
+
+    def get(self, stimulus_id):
+        slot = self.table.slot_of(stimulus_id)
+        if slot is not None:
+            return self.table[slot]
+
+    def slot_of(self, stimulus_id):
+        return self.table.slot_of(stimulus_id)
+
+    def add(self, appraisal):
+        '''
+        :param appraisal: Stimulus or StimulusView, copied into the store
+        :return: the slot of the copy
+        '''
+        return self.table.add(appraisal.id, appraisal.emo_intensity, np.asarray(appraisal.p_occurrence).item(),
+                              appraisal.resolvable, appraisal.encounter_counter, appraisal.reappraisal_counter)
+
+    def retire(self, stimulus_id):
+        table = self.table
+        slot = table.slot_of(stimulus_id)
+        if slot is None:
+            return
+        self.n_retired += 1
+        self.retired_encounters += int(table.encounter_counter[slot])
+        self.retired_reappraisals += int(table.reappraisal_counter[slot])
+        self.retired_resolvable += bool(table.resolvable[slot])
+        if self.keep_retired:
+            self._retired_records['id'].append(int(table.id[slot]))
+            self._retired_records['emo_intensity'].append(float(table.emo_intensity[slot]))
+            self._retired_records['encounters'].append(int(table.encounter_counter[slot]))
+            self._retired_records['reappraisals'].append(int(table.reappraisal_counter[slot]))
+            self._retired_records['resolvable'].append(bool(table.resolvable[slot]))
+        table.remove(stimulus_id)
+
+    def retired_records(self):
+        '''
+        :return: dict of numpy arrays with one entry per retired appraisal, empty unless keep_retired is set
+        '''
+        return {field: np.array(values, dtype=values.typecode) for field, values in self._retired_records.items()}
+
+    def summary(self):
+        '''
+        :return: per-stimulus statistics aggregated over live and retired appraisals
+        '''
+        slots = self.table.slots()
+        return {'live': len(self.table),
+                'retired': self.n_retired,
+                'encounters': self.retired_encounters + int(self.table.encounter_counter[slots].sum()),
+                'reappraisals': self.retired_reappraisals + int(self.table.reappraisal_counter[slots].sum()),
+                'resolvable': self.retired_resolvable + int(self.table.resolvable[slots].sum())}
+
+
 class AgentStatus:
 
-    def __init__(self):
-        self.stimuliAppraisals = list()
+    def __init__(self, keep_retired: bool = False):
+        self.appraisals = AppraisalStore(keep_retired=keep_retired)
         self.current_id = None
+        self.current_slot = None  # slot of the current appraisal in appraisals.table
         self.current_emo_intensity = None
         self.expected_p_occurrence = None
         self.current_encounter_counter = 0
+        self._to_retire = list()
         # self.previous_encounter = None
 
+    @property
+    def stimuliAppraisals(self):
+        return list(self.appraisals)
+
     def print_list(self):
-        for i in range(len(self.stimuliAppraisals)):
-            print(self.stimuliAppraisals[i].get_dict())
+        for appraisal in self.appraisals:
+            print(appraisal.get_dict())
 
-    def appraise_stimuli(self, stimulus: Stimulus):  # currently the appraisal function is 1:1, so just a copy
-        if not self._check_for_previous_encounter(stimulus):
-            self.stimuliAppraisals.append(copy.deepcopy(stimulus))
-        self._update_emotional_state(stimulus)
+    def get_appraisal(self, stimulus_id):
+        return self.appraisals.get(stimulus_id)
 
-    def _check_for_previous_encounter(self, stimulus):
-        for i in range(0, len(self.stimuliAppraisals)):
-            if self.stimuliAppraisals[i].id == stimulus.id:
-                return True
-        return False
+    def retire_stimulus(self, stimulus_id):
+        '''
+        Mark the appraisal of a replaced stimulus for retirement. It stays available until the next stimulus is appraised,
+        because the action of the next step still acts on it.
+        '''
+        self._to_retire.append(stimulus_id)
+
+    def appraise_stimuli(self, stimulus):  # currently the appraisal function is 1:1, so just a copy
+        self._retire_pending()
+        slot = self.appraisals.slot_of(stimulus.id)
+        if slot is None:
+            slot = self.appraisals.add(stimulus)
+        self._update_emotional_state(slot)
+
+    def appraise_row(self, stimuli: StimulusTable, row: int):
+        '''
+        appraise_stimuli for row of a StimulusTable, copying the row on the first encounter without creating objects
+        '''
+        self._retire_pending()
+        slot = self.appraisals.slot_of(int(stimuli.id[row]))
+        if slot is None:
+            slot = self.appraisals.table.copy_row(stimuli, row)
+        self._update_emotional_state(slot)
+
+    def _retire_pending(self):
+        if self._to_retire:
+            for stimulus_id in self._to_retire:
+                self.appraisals.retire(stimulus_id)
+            self._to_retire.clear()
 
-    def _update_emotional_state(self, stimulus):
-        for i in range(0, len(self.stimuliAppraisals)):
-            if self.stimuliAppraisals[i].id == stimulus.id:
-                self.current_emo_intensity = self.stimuliAppraisals[i].emo_intensity
-                self.expected_occurrence = self.stimuliAppraisals[i].p_occurrence
-                self.current_id = self.stimuliAppraisals[i].id
-                self.stimuliAppraisals[i].encounter_counter += 1
-                self.current_encounter_counter = self.stimuliAppraisals[i].encounter_counter
+    def _check_for_previous_encounter(self, stimulus):
+        return stimulus.id in self.appraisals
+
+    def _update_emotional_state(self, slot):
+        table = self.appraisals.table
+        self.current_slot = slot
+        self.current_emo_intensity = table.emo_intensity[slot]
+        self.expected_occurrence = table.p_occurrence[slot]
+        self.current_id = int(table.id[slot])
+        table.encounter_counter[slot] += 1
+        self.current_encounter_counter = int(table.encounter_counter[slot])
+
+
+class StimulusSampler:
+    '''
+    Samples stimulus slots according to their probability of occurrence.
+
+    Keeps a cumulative sum of the probabilities and finds slots by binary search. Uniform numbers are drawn from a
+    dedicated generator in blocks of block_size and turned into slots in one vectorized search. Changing the probability
+    of a slot only patches the cumulative sums after it.
+    '''
+
+    def __init__(self, p_occurrence, rng=None, block_size: int = 4096):
+        self.p_occurrence = np.array(p_occurrence, dtype=float).reshape(-1)
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.block_size = block_size
+        self._cdf = np.cumsum(self.p_occurrence)
+        self._block = np.empty(0, dtype=np.int64)
+        self._position = 0
+
+    def sample(self) -> int:
+        if self._position == len(self._block):
+            self._draw_block()
+        slot = self._block[self._position]
+        self._position += 1
+        return int(slot)
+
+    def update(self, slot: int, p_occurrence: float):
+        p_occurrence = float(np.asarray(p_occurrence).reshape(-1)[0])
+        delta = p_occurrence - self.p_occurrence[slot]
+        if delta == 0:
+            return
+        self.p_occurrence[slot] = p_occurrence
+        self._cdf[slot:] += delta
+        # slots already drawn from the old distribution are discarded
+        self._block = self._block[:self._position]
+
+    def _draw_block(self):
+        targets = self.rng.random(self.block_size) * self._cdf[-1]
+        self._block = np.minimum(np.searchsorted(self._cdf, targets, side='right'), len(self._cdf) - 1)
+        self._position = 0
 
 
 class EmotionEnv(gym.Env):
@@ -78,9 +384,17 @@ class EmotionEnv(gym.Env):
                  disengage_benefit: float,
                  engage_adaptation: float,
                  stimulus_max_occurrence: int,
-                 stimuli: list,
-                 agent_status: AgentStatus
+                 stimuli,
+                 agent_status: AgentStatus,
+                 rng: np.random.Generator = None,
+                 trajectory=None
                  ):
+        '''
+        :param stimuli: list of Stimulus or a StimulusTable, which the environment keeps and updates in place
+        :param rng: generator for sampling stimuli. Defaults to a generator seeded from the global numpy random state,
+                    so np.random.seed keeps runs reproducible
+        :param trajectory: optional trajectory.TrajectoryLogger that gets the stimulus of every step and replacements
+        '''
 
         super(EmotionEnv, self).__init__()
 
@@ -89,15 +403,19 @@ class EmotionEnv(gym.Env):
                                        'emo_intensity': Box(low=0, high=10, shape=(1,), dtype=np.float32),
                                        'emo_step:': Box(low=0, high=2, shape=(1,), dtype=np.int8)})
 
-        self.stimuli = stimuli
+        self.stimuli = stimuli if isinstance(stimuli, StimulusTable) else StimulusTable.from_stimuli(stimuli)
         self.n_stimuli = len(stimuli)
         self.engage_benefit = engage_benefit
         self.engage_adaptation = engage_adaptation
         self.disengage_benefit = disengage_benefit
         self.agent_status = agent_status
-        self.current_appraisal = None
         self.replacement_stimulus_counter = 0
         self.stimulus_max_occurrence = stimulus_max_occurrence
+        if rng is None:
+            rng = np.random.default_rng(np.random.randint(0, 2 ** 31 - 1))
+        self.sampler = StimulusSampler(self.stimuli.p_occurrence[:self.stimuli.size], rng=rng)
+        self.current_slot = None
+        self.trajectory = trajectory
 
     def step(self, action: int) -> tuple:
         '''
@@ -106,10 +424,6 @@ class EmotionEnv(gym.Env):
         :return: state, reward, done, info
         '''
 
-        for i in range(0, len(self.agent_status.stimuliAppraisals)):
-            if self.agent_status.stimuliAppraisals[i].id == self.agent_status.current_id:
-                self.current_appraisal = self.agent_status.stimuliAppraisals[i]
-
         # Take action
         if action == 1:
             self._disengage()
@@ -123,12 +437,20 @@ class EmotionEnv(gym.Env):
         info = None
         reward = self._get_reward()
 
+        if self.trajectory is not None:
+            self.trajectory.log_stimulus(self.agent_status.current_id, self.agent_status.current_encounter_counter,
+                                         self.agent_status.appraisals.table.reappraisal_counter[self.agent_status.current_slot])
+
         self.reset()
         self.refresh_stimuli_list()
         done = False
 
         return self.get_original_intensity(self.agent_status.current_id), reward, done, info  #
 
+    @property
+    def current_appraisal(self):
+        return self.agent_status.get_appraisal(self.agent_status.current_id)
+
     def _inaction(self):
         return self.agent_status
 
@@ -138,15 +460,16 @@ class EmotionEnv(gym.Env):
         return self.agent_status
 
     def _engage(self):
-        if self.current_appraisal.resolvable:
+        # the current appraisal is a row of the appraisal table, updated in place
+        appraisals = self.agent_status.appraisals.table
+        slot = self.agent_status.current_slot
+        if appraisals.resolvable[slot]:
             self.agent_status.current_emo_intensity -= self.engage_benefit
-            self.current_appraisal.emo_intensity -= self.engage_adaptation
-            self.current_appraisal.reappraisal_counter += 1
+            appraisals.emo_intensity[slot] = min(max(appraisals.emo_intensity[slot] - self.engage_adaptation, 0), 10)
         else:
-            self.agent_status.current_emo_intensity -= self.engage_benefit + (self.current_appraisal.reappraisal_counter * self.engage_adaptation)
-            self.current_appraisal.reappraisal_counter += 1
+            self.agent_status.current_emo_intensity -= self.engage_benefit + (appraisals.reappraisal_counter[slot] * self.engage_adaptation)
+        appraisals.reappraisal_counter[slot] += 1
         self.agent_status.current_emo_intensity = np.clip(self.agent_status.current_emo_intensity, 0, 10)
-        self.current_appraisal.emo_intensity = np.clip(self.current_appraisal.emo_intensity, 0, 10)
         return self.agent_status
 
     def _get_reward(self):
@@ -154,25 +477,26 @@ class EmotionEnv(gym.Env):
         return reward
 
     def reset(self):
-        probs = np.array([stimulus.get_p_occurrence() for stimulus in self.stimuli]).flatten()
-        new_stimulus = np.random.choice(self.stimuli, p=probs)
-        self.agent_status.appraise_stimuli(new_stimulus)
+        self.current_slot = self.sampler.sample()
+        self.agent_status.appraise_row(self.stimuli, self.current_slot)
 
     # stimulus gets replaced with a new stimulus with the same probability of occurrence and intensity, but new id
     def refresh_stimuli_list(self):
         if self.agent_status.current_encounter_counter == self.stimulus_max_occurrence:
             id_to_remove = self.agent_status.current_id
-            for j in range(0, len(self.stimuli)):
-                if self.stimuli[j].id == id_to_remove:
-                    new_id = len(self.stimuli) + self.replacement_stimulus_counter
-                    self.replacement_stimulus_counter += 1
-                    self.stimuli[j] = Stimulus(id=new_id, emo_intensity=self.stimuli[j].emo_intensity,
-                                               p_occurrence=self.stimuli[j].p_occurrence, resolvable=self.stimuli[j].resolvable)
+            new_id = len(self.stimuli) + self.replacement_stimulus_counter
+            self.replacement_stimulus_counter += 1
+            # the current stimulus was sampled from current_slot in reset. The new stimulus keeps its probability of
+            # occurrence, so the sampler is unchanged
+            self.stimuli.rekey(self.current_slot, new_id)
+            self.agent_status.retire_stimulus(id_to_remove)
+            if self.trajectory is not None:
+                self.trajectory.log_replacement(id_to_remove)
 
     def get_original_intensity(self, stimulus_id):
-        for i in range(0, len(self.agent_status.stimuliAppraisals)):
-            if self.agent_status.stimuliAppraisals[i].id == stimulus_id:
-                return self.agent_status.stimuliAppraisals[i].emo_intensity
+        slot = self.agent_status.appraisals.slot_of(stimulus_id)
+        if slot is not None:
+            return self.agent_status.appraisals.table.emo_intensity[slot]
 
     def render(self, mode='human'):
         '''
@@ -182,9 +506,6 @@ class EmotionEnv(gym.Env):
         '''
         if mode != 'human':
             raise NotImplementedError()
-        for i in range(0, len(self.agent_status.stimuliAppraisals)):
-            if self.agent_status.stimuliAppraisals[i].id == self.agent_status.current_id:
-                self.current_appraisal = self.agent_status.stimuliAppraisals[i]
 
         print({'timepoint': 1, 'emo_intensity': self.agent_status.current_emo_intensity,
                'stimulus id': self.agent_status.current_id})
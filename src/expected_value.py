@@ -0,0 +1,146 @@
+import numpy as np
+from scipy.special import comb
+
+N_ACTIONS = 3
+
+
+def bin_low_high_states(intensity):
+    '''
+    Vectorized state_encoding.bin_low_high, 3 states
+    '''
+    return np.where(intensity > 5, 2, np.where(intensity > 0, 1, 0))
+
+
+def intensity_states(intensity):
+    '''
+    One state per intensity 0 to 10, as in the balanced q-table agent with 11 states
+    '''
+    return np.rint(intensity).astype(int)
+
+
+def engage_count_weights(stimulus_max_occurrence, p_engage, n_counts):
+    '''
+    Probability that an encounter of a stimulus comes after j earlier engagements with it, for j < n_counts - 1, with
+    the remaining probability in the last entry.
+
+    A stimulus is encountered stimulus_max_occurrence times before it is replaced, so every encounter number k is
+    equally likely, and the number of earlier engagements is Binomial(k - 1, p_engage).
+    '''
+    encounters = np.arange(stimulus_max_occurrence)
+    counts = np.arange(n_counts - 1)
+    # binomial probabilities, without scipy.stats which is slow to import
+    weights = (comb(encounters[None, :], counts[:, None]) * p_engage ** counts[:, None]
+               * (1 - p_engage) ** np.maximum(encounters[None, :] - counts[:, None], 0)).mean(axis=1)
+    return np.append(weights, max(0.0, 1.0 - weights.sum()))
+
+
+def build_model(emo_intensity, p_occurrence, resolvable, engage_benefit, disengage_benefit, engage_adaptation,
+                stimulus_max_occurrence, p_engage=1 / 3, states=bin_low_high_states, n_states=3):
+    '''
+    Binned reward and transition model of EmotionEnv.
+
+    A situation is a stimulus together with the number of times it was engaged with before. Under a behaviour policy
+    that engages with probability p_engage, its probability is the stimulus' p_occurrence times the probability of that
+    number of engagements. Its state is the binned appraised intensity. The next stimulus does not depend on the action,
+    so every row of the transition model is the stationary state distribution.
+    :param emo_intensity: original intensity per stimulus
+    :param p_occurrence: probability of occurrence per stimulus
+    :param resolvable: resolvable flag per stimulus
+    :param p_engage: probability of engaging under the behaviour policy, 1/3 for uniformly random actions
+    :param states: function mapping an array of intensities to state ids below n_states
+    :return: rewards of shape (n_states, N_ACTIONS), transitions of shape (n_states, N_ACTIONS, n_states) and the
+             state distribution of shape (n_states,)
+    '''
+    emo_intensity = np.asarray(emo_intensity, dtype=float).reshape(-1)
+    p_occurrence = np.asarray(p_occurrence, dtype=float).reshape(-1)
+    resolvable = np.asarray(resolvable, dtype=bool).reshape(-1)
+
+    # Beyond n_counts - 1 engagements every intensity is clipped at 0, so larger counts can be lumped together
+    n_counts = 1 if engage_adaptation == 0 else int(np.ceil(10 / engage_adaptation)) + 2
+    engaged = np.arange(n_counts)
+    weights = engage_count_weights(int(stimulus_max_occurrence), p_engage, n_counts)
+
+    probability = p_occurrence[:, None] * weights[None, :]
+    appraisal = np.where(resolvable[:, None], np.clip(emo_intensity[:, None] - engaged * engage_adaptation, 0, 10),
+                         emo_intensity[:, None])
+    rewards = np.stack([10 - appraisal,
+                        10 - np.clip(appraisal - disengage_benefit, 0, 10),
+                        10 - np.clip(appraisal - np.where(resolvable[:, None], engage_benefit,
+                                                          engage_benefit + engaged * engage_adaptation), 0, 10)],
+                       axis=-1)
+    state = states(appraisal).reshape(-1)
+
+    distribution = np.bincount(state, weights=probability.reshape(-1), minlength=n_states)
+    reward_sums = np.stack([np.bincount(state, weights=(probability * rewards[..., a]).reshape(-1), minlength=n_states)
+                            for a in range(N_ACTIONS)], axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        expected_rewards = np.where(distribution[:, None] > 0, reward_sums / distribution[:, None], 0.0)
+    transitions = np.broadcast_to(distribution / distribution.sum(), (n_states, N_ACTIONS, n_states)).copy()
+    return expected_rewards, transitions, distribution
+
+
+def solve_q(rewards, transitions, gamma, tolerance=1e-10, max_iterations=100000):
+    '''
+    Optimal state-action values of a finite model by vectorized value iteration. With gamma >= 1 the iteration does not
+    converge and max_iterations is the horizon: the values are the expected rewards of the next max_iterations steps
+    :param rewards: array of shape (n_states, n_actions)
+    :param transitions: array of shape (n_states, n_actions, n_states)
+    '''
+    q = np.zeros_like(rewards)
+    for _ in range(max_iterations):
+        updated = rewards + gamma * transitions @ q.max(axis=1)
+        if np.max(np.abs(updated - q)) < tolerance:
+            return updated
+        q = updated
+    return q
+
+
+def expected_values(emo_intensity, p_occurrence, resolvable, engage_benefit, disengage_benefit, engage_adaptation,
+                    stimulus_max_occurrence, gamma, p_engage=1 / 3, states=intensity_states, n_states=11,
+                    horizon=None):
+    '''
+    Expected value of every action per state, without simulating a balanced agent.
+
+    By default there is one state per intensity 0 to 10, the layout of the _expectedValue tables of the balanced q-table
+    agent with 11 states. The values are in the rewards of EmotionEnv, 10 minus the clipped intensity, so they are not
+    on the scale of the tables written by that agent. Pass states=bin_low_high_states and n_states=3 for the states of
+    the trained agents.
+
+    Because the next state does not depend on the action, the value iteration has the closed form
+    Q(s, a) = R(s, a) + gamma / (1 - gamma) * sum_s' d(s') max_a' R(s', a'). States that never occur keep the value 0,
+    like unvisited rows of a learned q-table.
+    :param gamma: discount factor, at most 1
+    :param horizon: with gamma = 1, the number of steps the values look ahead, which solve_q iterates over. With
+                    gamma < 1 the values look infinitely far ahead
+    :return: array of shape (n_states, N_ACTIONS)
+    '''
+    if gamma > 1 or (gamma == 1 and horizon is None):
+        raise ValueError(f'Expected values need gamma < 1, or gamma = 1 with a finite horizon, got gamma {gamma}')
+    rewards, transitions, distribution = build_model(emo_intensity, p_occurrence, resolvable, engage_benefit,
+                                                     disengage_benefit, engage_adaptation, stimulus_max_occurrence,
+                                                     p_engage=p_engage, states=states, n_states=n_states)
+    if gamma < 1:
+        d = distribution / distribution.sum()
+        q = rewards + gamma / (1 - gamma) * np.dot(d, rewards.max(axis=1))
+    else:
+        q = solve_q(rewards, transitions, gamma, max_iterations=horizon)
+    q[distribution == 0] = 0
+    return q
+
+
+def expected_values_for_stimuli(stimuli, parameters, **kwargs):
+    '''
+    expected_values for a StimulusTable or a list of Stimulus objects and a dict of grid parameters
+    '''
+    if hasattr(stimuli, 'columns'):
+        columns = stimuli.columns()
+    else:
+        columns = {'emo_intensity': [stimulus.emo_intensity for stimulus in stimuli],
+                   'p_occurrence': [np.asarray(stimulus.p_occurrence).item() for stimulus in stimuli],
+                   'resolvable': [stimulus.resolvable for stimulus in stimuli]}
+    return expected_values(columns['emo_intensity'], columns['p_occurrence'], columns['resolvable'],
+                           engage_benefit=parameters['engage_benefit'],
+                           disengage_benefit=parameters['disengage_benefit'],
+                           engage_adaptation=parameters['engage_adaptation'],
+                           stimulus_max_occurrence=parameters['STIMULUS_MAX_OCCURRENCE'],
+                           gamma=parameters['gamma'], **kwargs)
@@ -0,0 +1,251 @@
+import math
+
+import numpy as np
+
+from training import N_ACTIONS, N_STATES, STIMULUS_INT_MAX, STIMULUS_INT_MIN
+from expected_value import expected_values
+
+POLICIES = {'epsilon_greedy': 0, 'softmax_q': 1}
+
+# Layout of the scalar simulation state passed between kernel calls
+SLOT, INTENSITY, PENDING, STATE, ACTION, EPSILON = range(6)
+
+
+def _kernel(n_steps, offset, sim, params, cdf, original_intensity, resolvable, intensity, encounters, reappraisals,
+            qtable, action_counts, action_trace, reward_trace, q_delta_trace, u_stimulus, u_explore, u_choice):
+    '''
+    EmotionEnv.step -> QTableAgent.update -> choose_action for n_steps steps on a compact state.
+
+    Stimuli are slots of the arrays original_intensity, resolvable, intensity, encounters and reappraisals, where
+    intensity, encounters and reappraisals are the appraisal of the stimulus currently in the slot. A replaced stimulus
+    gets a fresh appraisal at the next stimulus draw, after the action of the next step has acted on the old one, as in
+    EmotionEnv. qtable and action_counts are flattened to N_STATES * N_ACTIONS entries. All randomness comes from the
+    u_* arrays, three uniform numbers per step.
+    '''
+    engage_benefit, disengage_benefit, engage_adaptation, max_occurrence, alpha, gamma, decay_factor, policy = params
+    n_stimuli = len(cdf)
+    total = cdf[n_stimuli - 1]
+    slot = int(sim[SLOT])
+    current = sim[INTENSITY]
+    pending = sim[PENDING] > 0
+    state = int(sim[STATE])
+    action = int(sim[ACTION])
+    epsilon = sim[EPSILON]
+    n_replaced = 0
+
+    for i in range(n_steps):
+        # Take action
+        if action == 1:
+            current = current - disengage_benefit
+        elif action == 2:
+            if resolvable[slot]:
+                current = current - engage_benefit
+                intensity[slot] = min(max(intensity[slot] - engage_adaptation, 0.0), 10.0)
+            else:
+                current = current - (engage_benefit + reappraisals[slot] * engage_adaptation)
+            reappraisals[slot] += 1
+        current = min(max(current, 0.0), 10.0)
+        reward = 10.0 - current
+
+        # Replace the previous stimulus if it reached its maximum occurrence, then draw the next one
+        if pending:
+            intensity[slot] = original_intensity[slot]
+            encounters[slot] = 0
+            reappraisals[slot] = 0
+        target = u_stimulus[i] * total
+        low = 0
+        high = n_stimuli - 1
+        while low < high:
+            middle = (low + high) // 2
+            if cdf[middle] > target:
+                high = middle
+            else:
+                low = middle + 1
+        slot = low
+        encounters[slot] += 1
+        current = intensity[slot]
+        pending = encounters[slot] == max_occurrence
+        if pending:
+            n_replaced += 1
+
+        if current > 5:
+            next_state = 2
+        elif current > 0:
+            next_state = 1
+        else:
+            next_state = 0
+
+        # Q-learning update
+        best_next = qtable[next_state * N_ACTIONS + 0]
+        for a in range(1, N_ACTIONS):
+            if qtable[next_state * N_ACTIONS + a] > best_next:
+                best_next = qtable[next_state * N_ACTIONS + a]
+        previous_q = qtable[state * N_ACTIONS + action]
+        q = previous_q + alpha * (reward + gamma * best_next - previous_q)
+        qtable[state * N_ACTIONS + action] = q
+
+        action_counts[state * N_ACTIONS + action] += 1
+        action_trace[offset + i] = action
+        reward_trace[offset + i] = reward
+        q_delta_trace[offset + i] = q - previous_q
+
+        # Choose the next action
+        state = next_state
+        if policy == 0:
+            if u_explore[i] > epsilon:
+                best = qtable[state * N_ACTIONS + 0]
+                for a in range(1, N_ACTIONS):
+                    if qtable[state * N_ACTIONS + a] > best:
+                        best = qtable[state * N_ACTIONS + a]
+                n_best = 0
+                for a in range(N_ACTIONS):
+                    if qtable[state * N_ACTIONS + a] == best:
+                        n_best += 1
+                pick = int(u_choice[i] * n_best)
+                for a in range(N_ACTIONS):
+                    if qtable[state * N_ACTIONS + a] == best:
+                        if pick == 0:
+                            action = a
+                            break
+                        pick -= 1
+            else:
+                action = int(u_choice[i] * N_ACTIONS)
+        else:
+            best = qtable[state * N_ACTIONS + 0]
+            for a in range(1, N_ACTIONS):
+                if qtable[state * N_ACTIONS + a] > best:
+                    best = qtable[state * N_ACTIONS + a]
+            weight_sum = 0.0
+            for a in range(N_ACTIONS):
+                weight_sum += math.exp(qtable[state * N_ACTIONS + a] - best)
+            target = u_choice[i] * weight_sum
+            action = N_ACTIONS - 1
+            cumulative = 0.0
+            for a in range(N_ACTIONS):
+                cumulative += math.exp(qtable[state * N_ACTIONS + a] - best)
+                if cumulative > target:
+                    action = a
+                    break
+
+        if epsilon > 0.1:  # cap epsilon at .1
+            epsilon -= decay_factor
+
+    sim[SLOT] = slot
+    sim[INTENSITY] = current
+    sim[PENDING] = 1.0 if pending else 0.0
+    sim[STATE] = state
+    sim[ACTION] = action
+    sim[EPSILON] = epsilon
+    return n_replaced
+
+
+_compiled_kernel = None
+
+
+def compiled_kernel():
+    '''
+    The kernel compiled with numba, or None if numba is not installed. numba is slow to import, so it is only imported
+    when the fast path is first used
+    '''
+    global _compiled_kernel
+    if _compiled_kernel is None:
+        try:
+            from numba import njit
+        except ImportError:  # numba is optional, without it the kernel runs as plain Python on lists
+            return None
+        _compiled_kernel = njit(cache=True)(_kernel)
+    return _compiled_kernel
+
+
+def make_stimulus_arrays(rng: np.random.Generator, n_stimuli, percentage_resolvable, int_min=STIMULUS_INT_MIN,
+                         int_max=STIMULUS_INT_MAX):
+    '''
+    Same distribution as training.make_stimuli, drawn from a Generator
+    :return: intensities, probabilities of occurrence summing to 1 and resolvable flags, one entry per stimulus
+    '''
+    resolvable = np.zeros(n_stimuli, dtype=bool)
+    resolvable[rng.choice(n_stimuli, size=int(n_stimuli * percentage_resolvable), replace=False)] = True
+    emo_intensity = rng.integers(int_min, int_max + 1, size=n_stimuli).astype(float)
+    p_occurrence = rng.uniform(0, 1, size=n_stimuli)
+    return emo_intensity, p_occurrence / p_occurrence.sum(), resolvable
+
+
+def run_fast(parameters: dict, n_runs: int = 60000, policy: str = 'epsilon_greedy', seed=None,
+             block_size: int = 65536, use_numba: bool = True) -> dict:
+    '''
+    Fast path of training.train: the same simulation as one tight kernel, compiled with numba when it is installed.
+
+    All random numbers come from one numpy.random.Generator in blocks of block_size steps, so the results for a seed
+    are identical across runs, block sizes and with or without numba. They are not identical to training.train for the
+    same seed, which draws from other random streams.
+    :param seed: int or numpy.random.SeedSequence, defaults to the row's SEED
+    :return: dict in the format of TrainingRun.results
+    '''
+    if policy not in POLICIES:
+        raise NotImplementedError(f'The fast path supports the policies {list(POLICIES)}, not {policy}')
+    rng = np.random.default_rng(parameters['SEED'] if seed is None else seed)
+
+    emo_intensity, p_occurrence, resolvable = make_stimulus_arrays(rng, parameters['N_STIMULI'],
+                                                                   parameters['PERCENTAGE_RESOLVABLE_STIMULI'])
+    cdf = np.cumsum(p_occurrence)
+    intensity = emo_intensity.copy()
+    encounters = np.zeros(len(cdf), dtype=np.int64)
+    reappraisals = np.zeros(len(cdf), dtype=np.int64)
+    qtable = np.zeros(N_STATES * N_ACTIONS)
+    action_counts = np.zeros(N_STATES * N_ACTIONS)
+    action_trace = np.zeros(n_runs, dtype=np.int64)
+    reward_trace = np.zeros(n_runs)
+    q_delta_trace = np.zeros(n_runs)
+
+    # First stimulus, as in env.reset() before training
+    slot = min(int(np.searchsorted(cdf, rng.random() * cdf[-1], side='right')), len(cdf) - 1)
+    encounters[slot] += 1
+    current = intensity[slot]
+    state = 2 if current > 5 else (1 if current > 0 else 0)
+    sim = np.array([slot, current, 0.0, state, 0.0, parameters['epsilon']])
+    params = (float(parameters['engage_benefit']), float(parameters['disengage_benefit']),
+              float(parameters['engage_adaptation']), int(parameters['STIMULUS_MAX_OCCURRENCE']),
+              float(parameters['alpha']), float(parameters['gamma']),
+              float(parameters['epsilon']) / (n_runs * .7), POLICIES[policy])
+
+    kernel = compiled_kernel() if use_numba else None
+    if kernel is not None:
+        arrays = [cdf, emo_intensity, resolvable, intensity, encounters, reappraisals, qtable, action_counts,
+                  action_trace, reward_trace, q_delta_trace]
+    else:
+        # Plain Python is much faster on lists of floats than on numpy scalars
+        kernel = _kernel
+        arrays = [array.tolist() for array in (cdf, emo_intensity, resolvable, intensity, encounters, reappraisals,
+                                               qtable, action_counts, action_trace, reward_trace, q_delta_trace)]
+        sim = sim.tolist()
+
+    n_replaced = 0
+    for offset in range(0, n_runs, block_size):
+        n_steps = min(block_size, n_runs - offset)
+        uniforms = rng.random((n_steps, 3)).T.copy()  # step-major, so the stream does not depend on block_size
+        if kernel is _kernel:
+            uniforms = uniforms.tolist()
+        n_replaced += kernel(n_steps, offset, sim, params, *arrays, uniforms[0], uniforms[1], uniforms[2])
+
+    qtable, action_counts, action_trace, reward_trace, q_delta_trace = (
+        np.asarray(array) for array in arrays[6:])
+    qtable = qtable.reshape(N_STATES, N_ACTIONS)
+    action_counts = action_counts.reshape(N_STATES, N_ACTIONS)
+
+    rewards = np.zeros((n_runs, N_ACTIONS))
+    rewards[np.arange(n_runs), action_trace] = reward_trace
+    rewards_cum_mean = np.cumsum(rewards, axis=0) / (np.cumsum(rewards != 0, axis=0) + 1)
+
+    return {'parameters': dict(parameters, N_RUNS=n_runs, STIMULUS_INT_MIN=STIMULUS_INT_MIN,
+                               STIMULUS_INT_MAX=STIMULUS_INT_MAX),
+            'actionPerIntensity': action_counts,
+            'learnedValue': qtable.round(decimals=2),
+            'expectedValue': expected_values(emo_intensity, p_occurrence, resolvable,
+                                             engage_benefit=parameters['engage_benefit'],
+                                             disengage_benefit=parameters['disengage_benefit'],
+                                             engage_adaptation=parameters['engage_adaptation'],
+                                             stimulus_max_occurrence=parameters['STIMULUS_MAX_OCCURRENCE'],
+                                             gamma=parameters['gamma'], horizon=n_runs).round(decimals=2),
+            'RewardsCumMean': rewards_cum_mean,
+            'qTableUpdateAmount': q_delta_trace,
+            'replacements': n_replaced}
@@ -0,0 +1,123 @@
+import argparse
+import glob
+import os
+import re
+
+import numpy as np
+
+from training import ACTION_NAMES
+
+ACTION_COLORS = ('olive', 'blue', 'red')
+
+# Outputs that can be plotted, see plot_output
+PLOT_KINDS = ('actionPerIntensity', 'RewardsCumMean', 'qTableUpdateAmount', 'learnedValue', 'expectedValue')
+
+
+def _pyplot(headless: bool):
+    '''
+    matplotlib is imported on first use only, with a non-interactive backend when no window is shown
+    '''
+    import matplotlib
+    if headless:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def plot_output(ax, kind: str, values, steps=None):
+    '''
+    Draw one output of a grid row, as in run_training.py
+    :param values: array with one column per action, or one column for qTableUpdateAmount
+    :param steps: time steps of the rows of values, defaults to their index
+    '''
+    values = np.asarray(values)
+    x = np.arange(len(values)) if steps is None else steps
+    if kind == 'qTableUpdateAmount':
+        ax.plot(x, values, marker='', color=ACTION_COLORS[0], linewidth=2)
+    else:
+        for i, (action, color) in enumerate(zip(ACTION_NAMES, ACTION_COLORS)):
+            ax.plot(x, values[:, i], marker='', color=color, linewidth=2, label=action)
+        ax.legend()
+    ax.set_title(kind)
+    ax.set_xlabel('step' if kind in ('RewardsCumMean', 'qTableUpdateAmount') else 'state')
+
+
+def show_results(results: dict, steps=None):
+    '''
+    Show the outputs of one grid row in a window
+    :param results: dict as returned by TrainingRun.results
+    '''
+    plt = _pyplot(headless=False)
+    kinds = [kind for kind in PLOT_KINDS[:3] if kind in results]
+    fig, axes = plt.subplots(1, len(kinds), figsize=(6 * len(kinds), 4))
+    for ax, kind in zip(np.atleast_1d(axes), kinds):
+        plot_output(ax, kind, results[kind], steps=steps if kind != 'actionPerIntensity' else None)
+    plt.show()
+
+
+def save_results(results: dict, prefix: str):
+    '''
+    Write every output of one grid row as <prefix>_<kind>.png, without a display
+    '''
+    plt = _pyplot(headless=True)
+    for kind in PLOT_KINDS:
+        if kind not in results:
+            continue
+        fig, ax = plt.subplots(figsize=(6, 4))
+        plot_output(ax, kind, results[kind])
+        fig.savefig(prefix + '_' + kind + '.png', dpi=100, bbox_inches='tight')
+        plt.close(fig)
+
+
+def load_parquet_rows(path: str, rows: list = None) -> dict:
+    '''
+    :return: dict of grid row to its outputs, read from a sweep's parquet file
+    '''
+    from result_store import read_results
+    data = read_results(path, columns=['row', 'kind', 'index', *ACTION_NAMES], rows=rows)
+    outputs = {}
+    for (row, kind), group in data.groupby(['row', 'kind'], observed=True):
+        outputs.setdefault(int(row), {})[kind] = group.sort_values('index')[list(ACTION_NAMES)].to_numpy()
+    return outputs
+
+
+def load_csv_rows(folder_path: str, file_name: str, rows: list = None) -> dict:
+    '''
+    :return: dict of grid row to its outputs, read from the CSV files written by sweep.write_row_csv
+    '''
+    import pandas as pd
+    pattern = re.compile(re.escape(file_name) + r'_(\d+)_(' + '|'.join(PLOT_KINDS) + r')\.csv$')
+    outputs = {}
+    for path in glob.glob(os.path.join(folder_path, file_name + '_*.csv')):
+        match = pattern.search(os.path.basename(path))
+        if match is None or (rows is not None and int(match.group(1)) not in rows):
+            continue
+        outputs.setdefault(int(match.group(1)), {})[match.group(2)] = (
+            pd.read_csv(path, index_col=0)[list(ACTION_NAMES)].to_numpy())
+    return outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Plot the outputs of a sweep, after it has run')
+    parser.add_argument('source', help='parquet file or folder of CSV files of a sweep')
+    parser.add_argument('--name', default=None,
+                        help='file name of the sweep, defaults to the name of the parquet file or of the CSV folder')
+    parser.add_argument('--out', default=None, help='folder for the plots, defaults to ../plots/<name>')
+    parser.add_argument('--rows', type=int, nargs='+', default=None, help='grid rows to plot, defaults to all')
+    args = parser.parse_args()
+
+    if os.path.isdir(args.source):
+        name = args.name if args.name is not None else os.path.basename(os.path.normpath(args.source))
+        outputs = load_csv_rows(args.source, name, rows=args.rows)
+    else:
+        name = args.name if args.name is not None else os.path.splitext(os.path.basename(args.source))[0]
+        outputs = load_parquet_rows(args.source, rows=args.rows)
+    out_path = args.out if args.out is not None else os.path.join('..', 'plots', name)
+    os.makedirs(out_path, exist_ok=True)
+    for row, results in sorted(outputs.items()):
+        save_results(results, os.path.join(out_path, name + '_' + str(row)))
+    print(f'{len(outputs)} rows plotted to {out_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+import numpy as np
+
+from environment import StimulusTable
+from agent import VectorQTableAgent
+from training import N_ACTIONS, N_STATES, make_stimuli
+
+# Parameters that can differ between the agents of a population
+AGENT_PARAMETERS = ('alpha', 'gamma', 'epsilon', 'engage_benefit', 'disengage_benefit', 'engage_adaptation')
+
+
+class StimulusSchedule:
+    '''
+    The stream of stimuli of an EmotionEnv, sampled once for n_steps steps so any number of agents can share it.
+
+    Which stimulus occurs and when it is replaced does not depend on the agent's actions: a stimulus is replaced after
+    stimulus_max_occurrence encounters, whatever the agent did. For every step the schedule holds the slot of the
+    occurring stimulus, its id, its encounter count and whether the agent appraises it afresh because it is new. Slots
+    are drawn as by StimulusSampler, so the same rng gives the same stream as an EmotionEnv.
+    '''
+
+    def __init__(self, stimuli, stimulus_max_occurrence: int, n_steps: int, rng=None):
+        '''
+        :param stimuli: list of Stimulus or a StimulusTable
+        :param n_steps: number of steps, the schedule has one more position for the appraisal before the first step
+        '''
+        table = stimuli if isinstance(stimuli, StimulusTable) else StimulusTable.from_stimuli(stimuli)
+        columns = table.columns()
+        self.n_stimuli = len(columns['id'])
+        self.original_intensity = columns['emo_intensity'].astype(float)
+        self.resolvable = columns['resolvable'].astype(bool)
+        self.stimulus_max_occurrence = int(stimulus_max_occurrence)
+        rng = rng if rng is not None else np.random.default_rng()
+
+        cdf = np.cumsum(columns['p_occurrence'].astype(float))
+        targets = rng.random(n_steps + 1) * cdf[-1]
+        self.slots = np.minimum(np.searchsorted(cdf, targets, side='right'), self.n_stimuli - 1).astype(np.int32)
+
+        # rank of every occurrence among the occurrences of its slot
+        order = np.argsort(self.slots, kind='stable')
+        sorted_slots = self.slots[order]
+        starts = np.searchsorted(sorted_slots, sorted_slots, side='left')
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order)) - starts
+
+        generation, position = np.divmod(rank, self.stimulus_max_occurrence)
+        if self.stimulus_max_occurrence == 1:
+            # EmotionEnv only replaces stimuli after a step, not after the appraisal at reset, so the stimulus at
+            # position 0 is not replaced. Its encounter count then passes stimulus_max_occurrence and it never is
+            first = self.slots == self.slots[0]
+            generation[first] = 0
+            position[first] = rank[first]
+        self.encounters = (position + 1).astype(np.int32)
+        self.fresh = position == 0
+        self.replaced = self.encounters == self.stimulus_max_occurrence
+        self.replaced[0] = False
+
+        # a replacement gets the id len(stimuli) + the number of earlier replacements, as in EmotionEnv
+        replacement_number = np.cumsum(self.replaced) - 1
+        self.ids = columns['id'][self.slots].astype(np.int64)
+        # the occurrence that replaced the previous generation of a renamed stimulus
+        renamed = np.flatnonzero(generation > 0)
+        first_of_slot = starts[np.argsort(order)][renamed]
+        creator = order[first_of_slot + generation[renamed] * self.stimulus_max_occurrence - 1]
+        self.ids[renamed] = self.n_stimuli + replacement_number[creator]
+
+    @property
+    def n_steps(self):
+        return len(self.slots) - 1
+
+
+class Population:
+    '''
+    Tabular Q-learning agents that differ in AGENT_PARAMETERS, trained in lockstep on one shared StimulusSchedule.
+
+    The agents' appraisals are arrays of shape (n_stimuli, n_agents), so the appraisals of one stimulus are contiguous,
+    and their q-tables are those of an agent.VectorQTableAgent. Every step advances the whole population with a fixed
+    number of array operations. The state of an agent is the bin_low_high state of its current appraisal, and epsilon
+    decays as in training.TrainingRun.
+
+    Telemetry is kept per agent: action counts per state, and every `decimation` steps the cumulative mean reward per
+    action and the q-value changes summed since the previous record, as by telemetry.TelemetryRecorder.
+    '''
+
+    def __init__(self, schedule: StimulusSchedule, alpha, gamma, epsilon, engage_benefit, disengage_benefit,
+                 engage_adaptation, n_runs: int = None, policy: str = 'epsilon_greedy', decimation: int = 1, rng=None):
+        '''
+        AGENT_PARAMETERS are scalars or arrays with one value per agent
+        :param n_runs: number of steps, at most and by default the length of the schedule
+        :param rng: numpy.random.Generator for the agents' action choices
+        '''
+        agent_parameters = {'alpha': alpha, 'gamma': gamma, 'epsilon': epsilon, 'engage_benefit': engage_benefit,
+                            'disengage_benefit': disengage_benefit, 'engage_adaptation': engage_adaptation}
+        self.n_agents = int(np.broadcast(*[np.asarray(value) for value in agent_parameters.values()]).size)
+        self.parameters = {name: np.broadcast_to(np.asarray(value, dtype=float), (self.n_agents,)).copy()
+                           for name, value in agent_parameters.items()}
+        self.schedule = schedule
+        self.n_runs = schedule.n_steps if n_runs is None else min(n_runs, schedule.n_steps)
+        self.policy = policy
+        self.decay_factor = self.parameters['epsilon'] / (self.n_runs * .7)
+
+        self.agent = VectorQTableAgent(self.n_agents, N_STATES, N_ACTIONS, alpha=self.parameters['alpha'],
+                                       gamma=self.parameters['gamma'], epsilon=self.parameters['epsilon'], rng=rng)
+        self._agents = np.arange(self.n_agents)
+
+        self.emo_intensity = np.repeat(schedule.original_intensity[:, None], self.n_agents, axis=1)
+        self.reappraisal_counter = np.zeros((schedule.n_stimuli, self.n_agents), dtype=np.int32)
+
+        self.decimation = decimation
+        n_records = -(-self.n_runs // decimation)
+        self.action_counts = np.zeros((self.n_agents, N_STATES, N_ACTIONS))
+        self._reward_sum = np.zeros((self.n_agents, N_ACTIONS))
+        self._reward_nonzero = np.zeros((self.n_agents, N_ACTIONS))
+        self.rewards_cum_mean = np.zeros((n_records, self.n_agents, N_ACTIONS))
+        self.q_delta = np.zeros((n_records, self.n_agents))
+        self._q_delta_sum = np.zeros(self.n_agents)
+        self._n_recorded = 0
+
+        self.action = np.zeros(self.n_agents, dtype=np.int64)  # the first action
+        self.state = self._appraise(0)  # the first state
+        self.step_count = 0
+
+    def _appraise(self, position: int) -> np.ndarray:
+        '''
+        Make the stimulus at position of the schedule the current appraisal of every agent
+        :return: the state of every agent
+        '''
+        slot = self.schedule.slots[position]
+        if self.schedule.fresh[position]:
+            self.emo_intensity[slot] = self.schedule.original_intensity[slot]
+            self.reappraisal_counter[slot] = 0
+        self.current_emo_intensity = self.emo_intensity[slot].copy()
+        return (self.current_emo_intensity > 0).astype(np.int64) + (self.current_emo_intensity > 5)
+
+    def run(self, n_steps: int = None):
+        '''
+        Advance the population by n_steps, or until n_runs steps have been taken
+        '''
+        end = self.n_runs if n_steps is None else min(self.n_runs, self.step_count + n_steps)
+        schedule, agent, agents = self.schedule, self.agent, self._agents
+        engage_benefit = self.parameters['engage_benefit']
+        disengage_benefit = self.parameters['disengage_benefit']
+        engage_adaptation = self.parameters['engage_adaptation']
+        counts = self.action_counts.reshape(-1)
+        for i in range(self.step_count, end):
+            slot = schedule.slots[i]
+            action, state = self.action, self.state
+            disengage, engage = action == 1, action == 2
+
+            intensity = self.current_emo_intensity - disengage * disengage_benefit
+            if schedule.resolvable[slot]:
+                intensity -= engage * engage_benefit
+                appraised = self.emo_intensity[slot]
+                self.emo_intensity[slot] = np.where(engage, np.clip(appraised - engage_adaptation, 0, 10), appraised)
+            else:
+                intensity -= engage * (engage_benefit + self.reappraisal_counter[slot] * engage_adaptation)
+            self.reappraisal_counter[slot] += engage
+            reward = 10 - np.clip(intensity, 0, 10)
+
+            next_state = self._appraise(i + 1)
+            previous_q = agent.qtable[agents, state, action]
+            agent.update(state, next_state, action, reward)
+            self._q_delta_sum += agent.qtable[agents, state, action] - previous_q
+
+            counts[(agents * N_STATES + state) * N_ACTIONS + action] += 1
+            self._reward_sum[agents, action] += reward
+            self._reward_nonzero[agents, action] += reward != 0
+            if i % self.decimation == 0:
+                record = i // self.decimation
+                self.rewards_cum_mean[record] = self._reward_sum / (self._reward_nonzero + 1)
+                self.q_delta[record] = self._q_delta_sum
+                self._q_delta_sum[:] = 0
+                self._n_recorded = record + 1
+
+            self.state = next_state
+            self.action = agent.choose_action(next_state, policy=self.policy)
+            agent.epsilon = np.where(agent.epsilon > .1, agent.epsilon - self.decay_factor, agent.epsilon)
+            self.step_count = i + 1
+
+    @property
+    def finished(self):
+        return self.step_count >= self.n_runs
+
+    def results(self) -> dict:
+        '''
+        Outputs of every agent, as in TrainingRun.results with a leading agent axis, or an agent axis after the time
+        axis for the traces
+        '''
+        return {'parameters': dict(self.parameters, N_RUNS=self.n_runs),
+                'actionPerIntensity': self.action_counts,
+                'learnedValue': self.agent.qtable.round(decimals=2),
+                'RewardsCumMean': self.rewards_cum_mean[:self._n_recorded],
+                'qTableUpdateAmount': self.q_delta[:self._n_recorded]}
+
+
+def train_population(parameters: dict, agent_parameters: dict, n_runs: int = 60000, policy: str = 'epsilon_greedy',
+                     seed_sequence: np.random.SeedSequence = None, decimation: int = 1) -> dict:
+    '''
+    Train a population of agents on one environment
+    :param parameters: N_STIMULI, PERCENTAGE_RESOLVABLE_STIMULI, STIMULUS_MAX_OCCURRENCE and SEED of the environment,
+                       and defaults for AGENT_PARAMETERS
+    :param agent_parameters: dict of AGENT_PARAMETERS to arrays with one value per agent
+    :return: Population.results
+    '''
+    np.random.seed(parameters['SEED'])
+    stimuli = make_stimuli(parameters['N_STIMULI'], parameters['PERCENTAGE_RESOLVABLE_STIMULI'])
+    if seed_sequence is None:
+        seed_sequence = np.random.SeedSequence(parameters['SEED'])
+    schedule_seed, agent_seed = seed_sequence.spawn(2)
+    schedule = StimulusSchedule(stimuli, parameters['STIMULUS_MAX_OCCURRENCE'], n_runs,
+                                rng=np.random.default_rng(schedule_seed))
+    population = Population(schedule, **{name: agent_parameters.get(name, parameters.get(name))
+                                         for name in AGENT_PARAMETERS},
+                            policy=policy, decimation=decimation, rng=np.random.default_rng(agent_seed))
+    population.run()
+    return population.results()
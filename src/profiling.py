@@ -0,0 +1,169 @@
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+# Methods timed by PhaseProfiler, by the object they belong to
+ENV_PHASES = ('step', 'reset', 'refresh_stimuli_list')
+AGENT_PHASES = ('choose_action', 'update')
+PHASES = ENV_PHASES + AGENT_PHASES
+
+# Share of the slowest and of the fastest sampled calls left out of the mean time of a phase
+TRIM = .1
+
+
+def _trimmed_mean(values: list, trim: float = TRIM) -> float:
+    '''
+    :return: mean of values without the trim share of the smallest and of the largest, 0 without values
+    '''
+    if not values:
+        return 0.0
+    values = np.sort(values)
+    cut = int(len(values) * trim)
+    return float(values[cut:len(values) - cut].mean())
+
+
+class PhaseProfiler:
+    '''
+    Sampled wall-clock timers around the phases of the training loop.
+
+    instrument() replaces the PHASES methods of one environment and agent by wrappers that count every call and time
+    one call in sample_every, along with the net change of the number of allocated memory blocks during that call.
+    Objects that are not instrumented are untouched, so a run without a profiler pays nothing. start() and stop()
+    around the training loop measure its wall-clock time, steps per second and garbage collections.
+
+    The total time of a phase is estimated as its number of calls times the mean time of its sampled calls without the
+    TRIM share of the slowest and fastest ones, so a few calls interrupted by the system or a garbage collection do not
+    dominate it. EmotionEnv.step calls reset and refresh_stimuli_list, so their time is also part of the time of step.
+    The time of the loop not spent in any phase is reported as bookkeeping. A remainder that the estimates would make
+    negative is reported as 0 and the summary is flagged with estimates_clamped.
+    '''
+
+    def __init__(self, sample_every: int = 64):
+        self.sample_every = sample_every
+        self.calls = {phase: 0 for phase in PHASES}
+        self.durations = {phase: [] for phase in PHASES}  # seconds of every sampled call
+        self.net_blocks = {phase: 0 for phase in PHASES}
+        self.wall_seconds = 0.0
+        self.steps = 0
+        self.gc_collections = 0
+        self._started = None
+
+    def instrument(self, env, agent):
+        for phase in ENV_PHASES:
+            setattr(env, phase, self._wrap(phase, getattr(env, phase)))
+        for phase in AGENT_PHASES:
+            setattr(agent, phase, self._wrap(phase, getattr(agent, phase)))
+
+    def _wrap(self, phase, method):
+        calls, durations, net_blocks = self.calls, self.durations[phase], self.net_blocks
+        sample_every = self.sample_every
+        clock, allocated_blocks = time.perf_counter_ns, sys.getallocatedblocks
+        # phases are sampled at different calls, so a sampled step rarely includes the timers of a sampled reset
+        offset = PHASES.index(phase) * sample_every // len(PHASES)
+
+        def timed(*args, **kwargs):
+            n = calls[phase]
+            calls[phase] = n + 1
+            if (n + offset) % sample_every:
+                return method(*args, **kwargs)
+            start_blocks = allocated_blocks()
+            start = clock()
+            result = method(*args, **kwargs)
+            durations.append((clock() - start) * 1e-9)
+            net_blocks[phase] += allocated_blocks() - start_blocks
+            return result
+
+        return timed
+
+    def start(self, step_count: int):
+        self._started = (time.perf_counter(), step_count, sum(stats['collections'] for stats in gc.get_stats()))
+
+    def stop(self, step_count: int):
+        started, start_step, start_collections = self._started
+        self.wall_seconds += time.perf_counter() - started
+        self.steps += step_count - start_step
+        self.gc_collections += sum(stats['collections'] for stats in gc.get_stats()) - start_collections
+        self._started = None
+
+    def summary(self) -> dict:
+        '''
+        :return: steps, wall_seconds, steps_per_sec, gc_collections and per phase the number of calls and samples, the
+                 trimmed mean time and the mean net change of allocated blocks per sampled call, the estimated total
+                 time and its share of the wall-clock time. 'step_exclusive' is step without reset and
+                 refresh_stimuli_list. estimates_clamped tells whether a remainder was negative and reported as 0
+        '''
+        phases = {}
+        for phase in PHASES:
+            n_samples = len(self.durations[phase])
+            mean = _trimmed_mean(self.durations[phase])
+            phases[phase] = {'calls': self.calls[phase], 'samples': n_samples, 'mean_us': mean * 1e6,
+                             'net_blocks_per_call': self.net_blocks[phase] / max(n_samples, 1),
+                             'total_seconds': mean * self.calls[phase]}
+        exclusive = (phases['step']['total_seconds'] - phases['reset']['total_seconds']
+                     - phases['refresh_stimuli_list']['total_seconds'])
+        in_phases = sum(phases[phase]['total_seconds'] for phase in ('step', 'choose_action', 'update'))
+        bookkeeping = self.wall_seconds - in_phases
+        clamped = exclusive < 0 or bookkeeping < 0
+        exclusive, bookkeeping = max(exclusive, 0.0), max(bookkeeping, 0.0)
+        phases['step_exclusive'] = {'calls': self.calls['step'], 'samples': phases['step']['samples'],
+                                    'mean_us': exclusive / max(self.calls['step'], 1) * 1e6,
+                                    'net_blocks_per_call': None, 'total_seconds': exclusive}
+        phases['bookkeeping'] = {'calls': self.steps, 'samples': None,
+                                 'mean_us': bookkeeping / max(self.steps, 1) * 1e6,
+                                 'net_blocks_per_call': None, 'total_seconds': bookkeeping}
+        for timing in phases.values():
+            timing['share'] = timing['total_seconds'] / self.wall_seconds if self.wall_seconds else 0.0
+        return {'steps': self.steps, 'wall_seconds': self.wall_seconds,
+                'steps_per_sec': self.steps / self.wall_seconds if self.wall_seconds else 0.0,
+                'gc_collections': self.gc_collections, 'sample_every': self.sample_every, 'phases': phases,
+                'estimates_clamped': clamped}
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+def format_report(summaries: dict) -> str:
+    '''
+    Text table of the phases of one or more profiled runs
+    :param summaries: dict of a run's name to its PhaseProfiler.summary
+    '''
+    lines = []
+    for name, summary in summaries.items():
+        clamped = ''
+        if summary.get('estimates_clamped'):
+            clamped = ', phase estimates exceed the measured time, remainders clamped at 0'
+        lines.append(f"{name}: {summary['steps']} steps in {summary['wall_seconds']:.2f}s, "
+                     f"{summary['steps_per_sec']:.0f} steps/s, {summary['gc_collections']} gc collections{clamped}")
+        for phase, timing in summary['phases'].items():
+            blocks = ('' if timing['net_blocks_per_call'] is None
+                      else f"{timing['net_blocks_per_call']:>+8.1f} net allocated blocks")
+            lines.append(f"  {phase:<22}{timing['mean_us']:>10.2f}us {timing['share']:>7.1%}  {blocks}")
+    return '\n'.join(lines) + '\n'
+
+
+def load_profiles(paths: list) -> dict:
+    '''
+    :return: dict of file name to the summary saved by PhaseProfiler.save
+    '''
+    profiles = {}
+    for path in paths:
+        with open(path) as f:
+            profiles[os.path.basename(path)] = json.load(f)
+    return profiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print the phase timings of profiled runs')
+    parser.add_argument('paths', nargs='+', help='.profile.json files written by PhaseProfiler.save')
+    args = parser.parse_args()
+    print(format_report(load_profiles(args.paths)), end='')
+
+
+if __name__ == '__main__':
+    main()
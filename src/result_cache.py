@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from training import STIMULUS_INT_MAX, STIMULUS_INT_MIN, canonical_parameters
+
+# Modules whose code determines the outputs of a run: sweep._run_row, which seeds a row and decimates the outputs of
+# the fast path, and every module it imports. Changing any of them invalidates the cache
+SIMULATION_MODULES = ('sweep.py', 'environment.py', 'agent.py', 'training.py', 'telemetry.py', 'expected_value.py',
+                      'fast_path.py', 'convergence.py', 'state_encoding.py', 'trajectory.py', 'profiling.py')
+
+_code_version = None
+
+
+def code_version() -> str:
+    '''
+    sha256 of the sources of SIMULATION_MODULES
+    '''
+    global _code_version
+    if _code_version is None:
+        digest = hashlib.sha256()
+        folder = os.path.dirname(os.path.abspath(__file__))
+        for module in SIMULATION_MODULES:
+            with open(os.path.join(folder, module), 'rb') as f:
+                digest.update(f.read())
+        _code_version = digest.hexdigest()
+    return _code_version
+
+
+def cache_key(parameters: dict, n_runs: int, policy: str, decimation: int = 1, fast: bool = False,
+              convergence: dict = None, state_encoding: str = 'bin_low_high', learning: str = 'q_learning',
+              learning_options: dict = None) -> str:
+    '''
+    sha256 of everything that affects the outputs of a grid row: its parameters, the number of steps, the stimulus
+    intensity bounds, the policy, the output and simulation settings and the code version
+    '''
+    inputs = {'parameters': canonical_parameters(parameters), 'N_RUNS': int(n_runs),
+              'STIMULUS_INT_MIN': STIMULUS_INT_MIN, 'STIMULUS_INT_MAX': STIMULUS_INT_MAX, 'policy': policy,
+              'decimation': int(decimation), 'fast': bool(fast),
+              'convergence': {name: float(value) for name, value in convergence.items()} if convergence else None,
+              'state_encoding': state_encoding, 'learning': learning, 'learning_options': learning_options or None,
+              'code_version': code_version()}
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    '''
+    Outputs of grid rows stored by cache_key, one .npz file per row under path, so identical rows of different sweeps
+    are only computed once.
+
+    Reading an entry marks it as recently used by touching its file. With max_bytes, the least recently used entries are
+    removed whenever the cache grows beyond that size.
+    '''
+
+    def __init__(self, path: str, max_bytes: int = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._size = None
+        os.makedirs(path, exist_ok=True)
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key + '.npz')
+
+    def __contains__(self, key: str):
+        return os.path.exists(self._entry(key))
+
+    def _entries(self):
+        for folder in os.scandir(self.path):
+            if folder.is_dir():
+                for entry in os.scandir(folder.path):
+                    if entry.name.endswith('.npz'):
+                        yield entry
+
+    def __len__(self):
+        return sum(1 for _ in self._entries())
+
+    def size_bytes(self) -> int:
+        if self._size is None:
+            self._size = sum(entry.stat().st_size for entry in self._entries())
+        return self._size
+
+    def get(self, key: str):
+        '''
+        :return: the cached results in the format of TrainingRun.results, or None
+        '''
+        path = self._entry(key)
+        try:
+            with np.load(path) as data:
+                results = {name: data[name] for name in data.files}
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        results['parameters'] = json.loads(str(results['parameters']))
+        for name, value in results.items():
+            if isinstance(value, np.ndarray) and value.ndim == 0:
+                results[name] = value.item()
+        return results
+
+    def put(self, key: str, results: dict):
+        path = self._entry(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arrays = {name: np.asarray(value) for name, value in results.items() if name != 'parameters'}
+        arrays['parameters'] = np.array(json.dumps(results['parameters'], default=lambda value: value.item()))
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(path + '.tmp', path)
+        if self._size is not None:
+            self._size += os.path.getsize(path)
+        if self.max_bytes is not None and self.size_bytes() > self.max_bytes:
+            self.evict()
+
+    def evict(self, max_bytes: int = None):
+        '''
+        Remove the least recently used entries until the cache is no larger than max_bytes, defaulting to self.max_bytes
+        '''
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in self._entries()))
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in entries:
+            if size <= max_bytes:
+                break
+            os.remove(path)
+            size -= entry_size
+        self._size = size
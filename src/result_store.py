@@ -0,0 +1,153 @@
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from training import ACTION_NAMES
+
+# Outputs of TrainingRun.results with one column per action
+OUTPUT_KINDS = ('actionPerIntensity', 'learnedValue', 'RewardsCumMean', 'expectedValue', 'actionTrajectory')
+
+
+class ResultStore:
+    '''
+    All outputs of a sweep in one zstd compressed Parquet file, in long format.
+
+    Every record holds the grid row, the output kind, the index within that output (intensity state or time step),
+    one column per action and the row's parameters, so a query can select outputs by parameter value. For runs with a
+    sparse q-table, the learnedValue records also hold the fields of their learnedStates state in state_<field>
+    columns, which are null in other records. Each grid row is one row group.
+
+    Rows are first written as small parts to <path>.pending/ with an atomic rename, so a killed sweep loses at most
+    the rows that were being written. consolidate() moves the parts into the single file. R can read the file with
+    arrow::read_parquet.
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pending_path = path + '.pending'
+
+    def _pending_parts(self):
+        if not os.path.isdir(self.pending_path):
+            return []
+        return sorted(os.path.join(self.pending_path, name) for name in os.listdir(self.pending_path)
+                      if name.endswith('.parquet'))
+
+    def finished_rows(self) -> set:
+        '''
+        :return: the grid rows whose outputs are in the store
+        '''
+        rows = set()
+        if os.path.exists(self.path):
+            rows.update(pq.read_table(self.path, columns=['row']).column('row').unique().to_pylist())
+        for part in self._pending_parts():
+            rows.update(pq.read_table(part, columns=['row']).column('row').unique().to_pylist())
+        return rows
+
+    def append(self, row: int, results: dict):
+        '''
+        Store the outputs of one grid row
+        :param results: dict as returned by TrainingRun.results
+        '''
+        table = results_to_table(row, results)
+        os.makedirs(self.pending_path, exist_ok=True)
+        part = os.path.join(self.pending_path, f'row_{row}.parquet')
+        pq.write_table(table, part + '.tmp', compression='zstd')
+        os.replace(part + '.tmp', part)
+
+    def consolidate(self):
+        '''
+        Rewrite the store and its pending parts into the single file, and remove the pending folder once it is empty
+        '''
+        parts = self._pending_parts()
+        if not parts:
+            self._remove_empty_pending()
+            return
+        sources = ([self.path] if os.path.exists(self.path) else []) + parts
+        schema = pa.unify_schemas([pq.read_schema(source) for source in sources])
+        with pq.ParquetWriter(self.path + '.tmp', schema, compression='zstd') as writer:
+            for source in sources:
+                file = pq.ParquetFile(source)
+                for i in range(file.num_row_groups):
+                    writer.write_table(_conform(file.read_row_group(i), schema))
+        os.replace(self.path + '.tmp', self.path)
+        for part in parts:
+            os.remove(part)
+        self._remove_empty_pending()
+
+    def _remove_empty_pending(self):
+        if os.path.isdir(self.pending_path) and not os.listdir(self.pending_path):
+            os.rmdir(self.pending_path)
+
+    def read(self, columns: list = None, kinds: list = None, rows: list = None, filters: list = None):
+        '''
+        Load part of the store as a pandas DataFrame. Only the requested columns and matching row groups are decoded.
+        :param columns: columns to load, defaults to all
+        :param kinds: output kinds to load, e.g. ['actionPerIntensity']
+        :param rows: grid rows to load
+        :param filters: further pyarrow filters on parameter columns, e.g. [('alpha', '==', 0.1)]
+        '''
+        conditions = list(filters) if filters is not None else []
+        if kinds is not None:
+            conditions.append(('kind', 'in', list(kinds)))
+        if rows is not None:
+            conditions.append(('row', 'in', [int(row) for row in rows]))
+        sources = ([self.path] if os.path.exists(self.path) else []) + self._pending_parts()
+        if not sources:
+            raise FileNotFoundError(f'No results stored at {self.path}')
+        tables = [pq.read_table(source, columns=columns, filters=conditions or None) for source in sources]
+        return pa.concat_tables(tables, promote_options='default').to_pandas()
+
+
+def results_to_table(row: int, results: dict) -> pa.Table:
+    '''
+    Long format table of the outputs of one grid row
+    '''
+    kinds, indices, values = [], [], []
+    learned_start = None
+    for kind in OUTPUT_KINDS:
+        if kind not in results:
+            continue
+        output = np.asarray(results[kind], dtype=float).reshape(-1, len(ACTION_NAMES))
+        if kind == 'learnedValue':
+            learned_start = sum(len(previous) for previous in values)
+        kinds.append(np.full(len(output), kind, dtype=object))
+        indices.append(np.arange(len(output), dtype=np.int32))
+        values.append(output)
+    values = np.concatenate(values)
+    n = len(values)
+
+    columns = {'row': pa.array(np.full(n, row, dtype=np.int32)),
+               'kind': pa.array(np.concatenate(kinds)).dictionary_encode(),
+               'index': pa.array(np.concatenate(indices))}
+    for i, action in enumerate(ACTION_NAMES):
+        columns[action] = pa.array(values[:, i])
+    if 'learnedStates' in results:
+        states = results['learnedStates']
+        present = np.zeros(n, dtype=bool)
+        present[learned_start:learned_start + len(states)] = True
+        for field in states.dtype.names:
+            column = np.zeros(n, dtype=states.dtype[field])
+            column[present] = states[field]
+            columns['state_' + field] = pa.array(column, mask=~present)
+    for name, value in results['parameters'].items():
+        columns[name] = pa.array(np.full(n, value))
+    return pa.table(columns)
+
+
+def _conform(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    '''
+    Add missing parameter columns as nulls and order the columns like schema
+    '''
+    for field in schema:
+        if field.name not in table.column_names:
+            table = table.append_column(field, pa.nulls(len(table), type=field.type))
+    return table.select(schema.names).cast(schema)
+
+
+def read_results(path: str, **kwargs):
+    '''
+    Shortcut for ResultStore(path).read(**kwargs)
+    '''
+    return ResultStore(path).read(**kwargs)
@@ -0,0 +1,238 @@
+import copy
+import os
+import pickle
+import random
+
+import numpy as np
+
+from environment import AgentStatus, EmotionEnv, StimulusTable
+from agent import SparseQTableAgent
+from telemetry import TelemetryRecorder
+from training import LEARNING_MODES, TrainingRun
+
+SNAPSHOT_VERSION = 5
+
+# Parameters that can differ between a snapshot and the runs forked from it
+FORKABLE_PARAMETERS = ('alpha', 'gamma', 'epsilon', 'engage_benefit', 'disengage_benefit', 'engage_adaptation')
+
+# Running sums of a TelemetryRecorder, saved as they are
+TELEMETRY_SUMS = ('_count', '_reward_sum', '_reward_squares', '_action_reward_sum', '_action_reward_nonzero',
+                  '_q_delta_sum')
+
+
+def _save_telemetry(telemetry: TelemetryRecorder) -> dict:
+    '''
+    The running sums of a recorder and only the records taken so far, not the preallocated rest of its arrays
+    '''
+    n_recorded = telemetry._n_recorded
+    saved = {name: copy.copy(getattr(telemetry, name)) for name in TELEMETRY_SUMS}
+    saved.update({'n_states': telemetry.n_states, 'n_actions': telemetry.n_actions, 'n_runs': telemetry.n_runs,
+                  'decimation': telemetry.decimation, 'n_recorded': n_recorded,
+                  'rewards_cum_mean': telemetry.rewards_cum_mean[:n_recorded].copy(),
+                  'q_delta': telemetry.q_delta[:n_recorded].copy()})
+    return saved
+
+
+def _restore_telemetry(saved: dict) -> TelemetryRecorder:
+    telemetry = TelemetryRecorder(saved['n_states'], saved['n_actions'], saved['n_runs'],
+                                  decimation=saved['decimation'])
+    for name in TELEMETRY_SUMS:
+        setattr(telemetry, name, copy.copy(saved[name]))
+    n_recorded = saved['n_recorded']
+    telemetry.rewards_cum_mean[:n_recorded] = saved['rewards_cum_mean']
+    telemetry.q_delta[:n_recorded] = saved['q_delta']
+    telemetry._n_recorded = n_recorded
+    return telemetry
+
+
+def take_snapshot(run: TrainingRun) -> dict:
+    '''
+    Complete state of a training run, including the global random states, as plain arrays and values
+    '''
+    env, status, agent = run.env, run.agent_status, run.agent
+    store = status.appraisals
+    return {
+        'version': SNAPSHOT_VERSION,
+        'random_state': random.getstate(),
+        'numpy_random_state': np.random.get_state(),
+        'run': {'parameters': dict(run.parameters), 'n_runs': run.n_runs, 'policy': run.policy,
+                'decay_time': run.decay_time, 'decay_factor': run.decay_factor, 'action': run.action,
+                'state': run.state, 'step_count': run.step_count, 'telemetry': _save_telemetry(run.telemetry),
+                'state_encoder': copy.deepcopy(run.state_encoder), 'learning': run.learning,
+                'learning_options': copy.deepcopy(run.learning_options)},
+        'env': {'stimuli': env.stimuli.columns(),
+                'engage_benefit': env.engage_benefit, 'disengage_benefit': env.disengage_benefit,
+                'engage_adaptation': env.engage_adaptation, 'stimulus_max_occurrence': env.stimulus_max_occurrence,
+                'replacement_stimulus_counter': env.replacement_stimulus_counter, 'current_slot': env.current_slot,
+                'sampler': {'p_occurrence': env.sampler.p_occurrence.copy(), 'cdf': env.sampler._cdf.copy(),
+                            'block': env.sampler._block.copy(), 'position': env.sampler._position,
+                            'block_size': env.sampler.block_size,
+                            'rng_state': env.sampler.rng.bit_generator.state}},
+        'agent_status': {'appraisals': store.table.columns(),
+                         'keep_retired': store.keep_retired, 'n_retired': store.n_retired,
+                         'retired_encounters': store.retired_encounters,
+                         'retired_reappraisals': store.retired_reappraisals,
+                         'retired_resolvable': store.retired_resolvable,
+                         'retired_records': store.retired_records(),
+                         'current_id': status.current_id, 'current_emo_intensity': status.current_emo_intensity,
+                         'expected_occurrence': getattr(status, 'expected_occurrence', None),
+                         'current_encounter_counter': status.current_encounter_counter,
+                         'to_retire': list(status._to_retire)},
+        'agent': {'sparse': isinstance(agent, SparseQTableAgent), 'keys': list(getattr(agent, 'keys', ())),
+                  'n_states': agent.n_states, 'n_actions': agent.n_actions, 'qtable': agent.qtable.copy(),
+                  'alpha': agent.alpha, 'gamma': agent.gamma, 'epsilon': agent.epsilon, 't': agent.t,
+                  'action_history': agent.action_history.copy(), 'monitor': copy.deepcopy(agent.monitor),
+                  'learning_state': {name: copy.deepcopy(getattr(agent, name))
+                                     for name in getattr(agent, 'LEARNING_STATE', ())}},
+    }
+
+
+def restore(snapshot: dict, restore_random_state: bool = True, **overrides) -> TrainingRun:
+    '''
+    Rebuild a training run from a snapshot
+    :param restore_random_state: also reset the global random and np.random states to those of the snapshot
+    :param overrides: new values for FORKABLE_PARAMETERS, used from the snapshot's step on. The step is recorded as
+                      parameters['fork_step']. An epsilon override is the exploration rate at that step, recorded as
+                      parameters['fork_epsilon']: it decays to 0 over the rest of the exploration time, or stays as it
+                      is when that time is over, and parameters['epsilon'] keeps the start value
+    '''
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f"Snapshot version {snapshot.get('version')} is not supported, expected {SNAPSHOT_VERSION}")
+    unknown = set(overrides) - set(FORKABLE_PARAMETERS)
+    if unknown:
+        raise ValueError(f'Cannot change {sorted(unknown)} in a fork, only {FORKABLE_PARAMETERS}')
+
+    saved_env, saved_status, saved_agent = snapshot['env'], snapshot['agent_status'], snapshot['agent']
+
+    status = AgentStatus(keep_retired=saved_status['keep_retired'])
+    store = status.appraisals
+    store.table = StimulusTable.from_columns(saved_status['appraisals'])
+    store.n_retired = saved_status['n_retired']
+    store.retired_encounters = saved_status['retired_encounters']
+    store.retired_reappraisals = saved_status['retired_reappraisals']
+    store.retired_resolvable = saved_status['retired_resolvable']
+    for field, values in saved_status['retired_records'].items():
+        store._retired_records[field].extend(values.tolist())
+    status.current_id = saved_status['current_id']
+    status.current_slot = store.slot_of(status.current_id)
+    status.current_emo_intensity = saved_status['current_emo_intensity']
+    status.expected_occurrence = saved_status['expected_occurrence']
+    status.current_encounter_counter = saved_status['current_encounter_counter']
+    status._to_retire = list(saved_status['to_retire'])
+
+    saved_sampler = saved_env['sampler']
+    rng = np.random.default_rng()
+    rng.bit_generator.state = saved_sampler['rng_state']
+    stimuli = StimulusTable.from_columns(saved_env['stimuli'])
+    env = EmotionEnv(engage_benefit=overrides.get('engage_benefit', saved_env['engage_benefit']),
+                     disengage_benefit=overrides.get('disengage_benefit', saved_env['disengage_benefit']),
+                     engage_adaptation=overrides.get('engage_adaptation', saved_env['engage_adaptation']),
+                     stimulus_max_occurrence=saved_env['stimulus_max_occurrence'],
+                     stimuli=stimuli,
+                     agent_status=status,
+                     rng=rng)
+    env.replacement_stimulus_counter = saved_env['replacement_stimulus_counter']
+    env.current_slot = saved_env['current_slot']
+    env.sampler.block_size = saved_sampler['block_size']
+    env.sampler.p_occurrence = saved_sampler['p_occurrence'].copy()
+    env.sampler._cdf = saved_sampler['cdf'].copy()
+    env.sampler._block = saved_sampler['block'].copy()
+    env.sampler._position = saved_sampler['position']
+
+    learning_parameters = {name: overrides.get(name, saved_agent[name]) for name in ('alpha', 'gamma', 'epsilon')}
+    if saved_agent['sparse']:
+        agent = SparseQTableAgent(saved_agent['n_actions'], initial_capacity=max(len(saved_agent['keys']), 1),
+                                  **learning_parameters)
+        for key in saved_agent['keys']:
+            agent.row(key)
+        agent.qtable[:] = saved_agent['qtable']
+    else:
+        agent = LEARNING_MODES[snapshot['run']['learning']](saved_agent['n_states'], n_actions=saved_agent['n_actions'],
+                                                            **learning_parameters, **snapshot['run']['learning_options'])
+        agent.qtable = saved_agent['qtable'].copy()
+        for name, value in saved_agent['learning_state'].items():
+            setattr(agent, name, copy.deepcopy(value))
+    agent.t = saved_agent['t']
+    agent.action_history = saved_agent['action_history'].copy()
+    if saved_agent['monitor'] is not None:
+        agent.attach_monitor(copy.deepcopy(saved_agent['monitor']))
+
+    saved_run = snapshot['run']
+    run = TrainingRun.__new__(TrainingRun)
+    run.parameters = dict(saved_run['parameters'], **{name: value for name, value in overrides.items()
+                                                      if name != 'epsilon'})
+    if overrides:
+        run.parameters['fork_step'] = saved_run['step_count']
+    run.n_runs = saved_run['n_runs']
+    run.policy = saved_run['policy']
+    run.decay_time = saved_run['decay_time']
+    run.decay_factor = saved_run['decay_factor']
+    if 'epsilon' in overrides:
+        run.parameters['fork_epsilon'] = overrides['epsilon']
+        remaining_time = run.decay_time - saved_run['step_count']
+        run.decay_factor = overrides['epsilon'] / remaining_time if remaining_time > 0 else 0.0
+    run.stimuli = stimuli
+    run.agent_status = status
+    run.env = env
+    run.agent = agent
+    run.action = saved_run['action']
+    run.state = saved_run['state']
+    run.step_count = saved_run['step_count']
+    run.telemetry = _restore_telemetry(saved_run['telemetry'])
+    run.state_encoder = copy.deepcopy(saved_run['state_encoder'])
+    run.learning = saved_run['learning']
+    run.learning_options = copy.deepcopy(saved_run['learning_options'])
+    run.trajectory = None
+    run.profiler = None
+
+    if restore_random_state:
+        random.setstate(snapshot['random_state'])
+        np.random.set_state(snapshot['numpy_random_state'])
+    return run
+
+
+def fork(snapshot: dict, variations: list) -> list:
+    '''
+    Finish one run per dict of overrides, each continuing from the snapshot with the snapshot's random state, so a
+    shared prefix is simulated once for all of them
+    :param variations: list of dicts of FORKABLE_PARAMETERS
+    :return: the results of every fork, in the order of variations
+    '''
+    results = []
+    for variation in variations:
+        run = restore(snapshot, **variation)
+        run.run()
+        results.append(run.results())
+    return results
+
+
+def run_resumable(run: TrainingRun, path: str, every: int = 10000) -> TrainingRun:
+    '''
+    Run to the end, saving a snapshot to path every `every` steps. If path holds a snapshot, continue from it instead
+    of from the start, so an interrupted run can be resumed by calling this again
+    :return: the finished run, which is a different object than run after a resume
+    '''
+    if os.path.exists(path):
+        run = restore(load_snapshot(path))
+    while not run.finished:
+        run.run(every)
+        save_snapshot(take_snapshot(run), path)
+    return run
+
+
+def save_snapshot(snapshot: dict, path: str):
+    '''
+    Write atomically, so an interruption never leaves a truncated snapshot behind
+    '''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path: str) -> dict:
+    with open(path, 'rb') as f:
+        snapshot = pickle.load(f)
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f"Snapshot version {snapshot.get('version')} is not supported, expected {SNAPSHOT_VERSION}")
+    return snapshot
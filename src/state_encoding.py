@@ -0,0 +1,89 @@
+import numpy as np
+
+
+def bin_low_high(value):
+    if value > 5:
+        return 2
+    elif value > 0:
+        return 1
+    else:
+        return 0
+
+
+class BinLowHigh:
+    '''
+    Zero, low and high intensity of the current appraisal, the 3 states of the original model
+    '''
+
+    n_states = 3
+
+    def encode(self, agent_status):
+        return bin_low_high(agent_status.current_emo_intensity)
+
+    def summary_state(self, state):
+        '''
+        :return: the bin_low_high state of an encoded state, used for the per-state outputs of a run
+        '''
+        return state
+
+
+class IntensityLevels:
+    '''
+    One state per rounded intensity 0 to 10, as in the balanced q-table agent with 11 states
+    '''
+
+    n_states = 11
+
+    def encode(self, agent_status):
+        return int(round(float(agent_status.current_emo_intensity)))
+
+    def summary_state(self, state):
+        return bin_low_high(state)
+
+
+class AppraisalStates:
+    '''
+    The current appraisal as a tuple of its intensity level, encounter count, reappraisal count and resolvability.
+
+    Intensities 0 to 10 are rounded to intensity_levels equally spaced levels, and counts above their caps are lumped
+    together. Most combinations are never visited, so n_states is None and runs use agent.SparseQTableAgent, whose
+    visited states are written as the learnedStates output by state_records.
+    '''
+
+    n_states = None
+    # Fields of the records of state_records. resolvable is -1 when it is not part of the state
+    state_dtype = np.dtype([('intensity_level', np.int32), ('encounters', np.int32), ('reappraisals', np.int32),
+                            ('resolvable', np.int8)])
+
+    def __init__(self, intensity_levels: int = 11, max_encounters: int = 10, max_reappraisals: int = 10,
+                 resolvable: bool = True):
+        '''
+        :param resolvable: whether the state includes the resolvability of the stimulus
+        '''
+        self.intensity_levels = intensity_levels
+        self.max_encounters = max_encounters
+        self.max_reappraisals = max_reappraisals
+        self.resolvable = resolvable
+
+    def encode(self, agent_status):
+        appraisals = agent_status.appraisals.table
+        slot = agent_status.current_slot
+        level = int(round(float(agent_status.current_emo_intensity) / 10 * (self.intensity_levels - 1)))
+        return (level,
+                min(agent_status.current_encounter_counter, self.max_encounters),
+                min(int(appraisals.reappraisal_counter[slot]), self.max_reappraisals),
+                bool(appraisals.resolvable[slot]) if self.resolvable else None)
+
+    def summary_state(self, state):
+        return bin_low_high(state[0] * 10 / (self.intensity_levels - 1))
+
+    def state_records(self, states: list) -> np.ndarray:
+        '''
+        :return: structured array of state_dtype with one record per encoded state
+        '''
+        return np.array([(level, encounters, reappraisals, -1 if resolvable is None else int(resolvable))
+                         for level, encounters, reappraisals, resolvable in states], dtype=self.state_dtype)
+
+
+# State encodings by the name used in sweep specs
+STATE_ENCODINGS = {'bin_low_high': BinLowHigh, 'intensity': IntensityLevels, 'appraisal': AppraisalStates}
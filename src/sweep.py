@@ -0,0 +1,334 @@
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from training import ACTION_NAMES, GRID_COLUMNS, LEARNING_MODES, build_grid, canonical_parameters, row_parameters, train
+from fast_path import run_fast
+from state_encoding import STATE_ENCODINGS
+from convergence import ConvergenceMonitor
+
+# Set up logging
+logger = logging.getLogger(__name__)
+stream_handler = logging.StreamHandler(sys.stdout)
+formatter = logging.Formatter('%(message)s')
+stream_handler.setFormatter(formatter)
+logger.addHandler(stream_handler)
+logger.setLevel(logging.INFO)
+
+
+def row_seed_sequence(parameters: dict) -> np.random.SeedSequence:
+    '''
+    Independent random stream of one grid row, derived from the row's SEED and its other parameters. It does not depend
+    on the row's position in the grid, so the same parameters give the same outputs in every sweep
+    '''
+    other_parameters = {name: value for name, value in canonical_parameters(parameters).items() if name != 'SEED'}
+    digest = hashlib.sha256(json.dumps(other_parameters, sort_keys=True).encode()).digest()
+    return np.random.SeedSequence(entropy=int(parameters['SEED']), spawn_key=(int.from_bytes(digest[:8], 'little'),))
+
+
+def _run_row(row, grid_row, n_runs, policy, decimation, fast, convergence, trajectory_path=None,
+             state_encoding='bin_low_high', learning='q_learning', learning_options=None, profile_path=None):
+    parameters = row_parameters(grid_row)
+    seed_sequence = row_seed_sequence(parameters)
+    if fast:
+        results = run_fast(parameters, n_runs=n_runs, policy=policy, seed=seed_sequence)
+        results['RewardsCumMean'] = results['RewardsCumMean'][::decimation]
+        # the q-value change summed since the previous recorded step, as in telemetry.TelemetryRecorder
+        cumulative = np.cumsum(results['qTableUpdateAmount'])[::decimation]
+        results['qTableUpdateAmount'] = np.diff(cumulative, prepend=0.0)
+        return row, results
+    monitor = ConvergenceMonitor(**convergence) if convergence is not None else None
+    return row, train(parameters, n_runs=n_runs, policy=policy, seed_sequence=seed_sequence, decimation=decimation,
+                      convergence=monitor, trajectory_path=trajectory_path,
+                      state_encoder=STATE_ENCODINGS[state_encoding](), learning=learning,
+                      learning_options=learning_options, profile_path=profile_path)
+
+
+def write_row_csv(results: dict, folder_path: str, file_name: str, row: int):
+    '''
+    Write the outputs of one grid row as <file_name>_<row>_<kind>.csv files, the layout read by the R scripts. Runs with
+    a sparse q-table also get a learnedStates file with the state of every row of learnedValue
+    '''
+    import pandas as pd  # only needed for CSV output
+    prefix = os.path.join(folder_path, file_name + '_' + str(row))
+    pd.DataFrame(results['parameters'], index=[0]).to_csv(prefix + '_parameters.csv')
+    for kind in ('actionPerIntensity', 'learnedValue', 'expectedValue', 'RewardsCumMean'):
+        pd.DataFrame(results[kind], columns=ACTION_NAMES).to_csv(prefix + '_' + kind + '.csv')
+    if 'learnedStates' in results:
+        pd.DataFrame(results['learnedStates']).to_csv(prefix + '_learnedStates.csv')
+
+
+class SweepCheckpoint:
+    '''
+    Record of the grid rows of a sweep whose outputs have been written, one row number per line
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.finished = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.finished = {int(line) for line in f if line.strip()}
+
+    def mark_finished(self, row: int):
+        with open(self.path, 'a') as f:
+            f.write(f'{row}\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.finished.add(row)
+
+
+def run_sweep(grid: np.ndarray, folder_path: str, file_name: str, n_workers: int = None, n_runs: int = 60000,
+              policy: str = 'epsilon_greedy', output_format: str = 'parquet', decimation: int = 1, fast: bool = False,
+              convergence: dict = None, cache: str = None, cache_max_bytes: int = None, trace: bool = False,
+              state_encoding: str = 'bin_low_high', learning: str = 'q_learning', learning_options: dict = None,
+              profile: bool = False):
+    '''
+    Run every row of the grid on a pool of processes and write each row's outputs as soon as it finishes.
+
+    With output_format 'parquet' all rows go to <folder_path>/<file_name>.parquet (see result_store.ResultStore), with
+    'csv' every row is written as separate CSV files and recorded in <folder_path>/<file_name>_checkpoint.txt. Either
+    way, calling run_sweep again after the sweep was killed only runs the rows that are missing.
+    :param grid: array built by training.build_grid
+    :param n_workers: number of processes, defaults to the number of CPUs
+    :param decimation: keep the running mean rewards of every decimation-th step only
+    :param fast: run the rows with fast_path.run_fast instead of training.train
+    :param convergence: keyword arguments of a convergence.ConvergenceMonitor that ends each row once it converged
+    :param cache: folder of a result_cache.ResultCache. Rows found in it are copied instead of run, and finished rows
+                  are added to it
+    :param cache_max_bytes: size above which the least recently used rows are removed from the cache
+    :param trace: stream every step of every row to <folder_path>/<file_name>_<row>.trace, see trajectory.py. Traced
+                  rows are always run, also when they are in the cache
+    :param state_encoding: name of the agent's state encoding in state_encoding.STATE_ENCODINGS
+    :param learning: learning algorithm in training.LEARNING_MODES
+    :param learning_options: keyword arguments of the learning algorithm's agent, such as lambda_ for q_lambda
+    :param profile: time the phases of every row, see profiling.PhaseProfiler, in
+                    <folder_path>/<file_name>_<row>.profile.json, and summarize all rows in
+                    <folder_path>/<file_name>_profile.txt. Profiled rows are always run, also when they are in the cache
+    '''
+    if fast and convergence is not None:
+        raise ValueError('The fast path does not support convergence detection')
+    if fast and trace:
+        raise ValueError('The fast path does not support trajectory traces')
+    if fast and profile:
+        raise ValueError('The fast path does not support profiling')
+    if state_encoding not in STATE_ENCODINGS:
+        raise ValueError(f'Unknown state encoding {state_encoding}, expected one of {list(STATE_ENCODINGS)}')
+    if fast and state_encoding != 'bin_low_high':
+        raise ValueError('The fast path only supports the bin_low_high state encoding')
+    if learning not in LEARNING_MODES:
+        raise ValueError(f'Unknown learning mode {learning}, expected one of {list(LEARNING_MODES)}')
+    if fast and learning != 'q_learning':
+        raise ValueError('The fast path only supports q_learning')
+    if learning != 'q_learning' and STATE_ENCODINGS[state_encoding].n_states is None:
+        raise ValueError(f'The {learning} learning mode needs a state encoding with a fixed number of states')
+    os.makedirs(folder_path, exist_ok=True)
+    if output_format == 'parquet':
+        from result_store import ResultStore  # pyarrow is only needed in the main process
+        store = ResultStore(os.path.join(folder_path, file_name + '.parquet'))
+        store.consolidate()
+        finished = store.finished_rows()
+    elif output_format == 'csv':
+        checkpoint = SweepCheckpoint(os.path.join(folder_path, file_name + '_checkpoint.txt'))
+        finished = checkpoint.finished
+    else:
+        raise ValueError(f'Unknown output format {output_format}')
+    pending = [row for row in range(len(grid)) if row not in finished]
+    n_finished = len(grid) - len(pending)
+    logger.info(f'{n_finished}/{len(grid)} rows already finished')
+
+    def write(row, results):
+        if output_format == 'parquet':
+            store.append(row, results)
+        else:
+            write_row_csv(results, folder_path, file_name, row)
+            checkpoint.mark_finished(row)
+
+    keys = {}
+    if cache is not None:
+        from result_cache import ResultCache, cache_key
+        result_cache = ResultCache(cache, max_bytes=cache_max_bytes)
+        keys = {row: cache_key(row_parameters(grid[row]), n_runs, policy, decimation=decimation, fast=fast,
+                               convergence=convergence, state_encoding=state_encoding, learning=learning,
+                               learning_options=learning_options) for row in pending}
+
+    try:
+        to_run = []
+        for row in pending:
+            results = result_cache.get(keys[row]) if cache is not None and not trace and not profile else None
+            if results is None:
+                to_run.append(row)
+            else:
+                write(row, results)
+                n_finished += 1
+        if cache is not None:
+            logger.info(f'{len(pending) - len(to_run)} rows taken from the cache')
+
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(_run_row, row, grid[row], n_runs, policy, decimation, fast, convergence,
+                                       os.path.join(folder_path, f'{file_name}_{row}.trace') if trace else None,
+                                       state_encoding, learning, learning_options,
+                                       os.path.join(folder_path, f'{file_name}_{row}.profile.json') if profile else None)
+                       for row in to_run]
+            for future in as_completed(futures):
+                row, results = future.result()
+                write(row, results)
+                if cache is not None:
+                    result_cache.put(keys[row], results)
+                n_finished += 1
+                logger.info(f'{n_finished}/{len(grid)} rows finished')
+    finally:
+        if output_format == 'parquet':
+            store.consolidate()
+    if profile:
+        write_profile_report(folder_path, file_name)
+
+
+def write_profile_report(folder_path: str, file_name: str):
+    '''
+    Summarize the .profile.json files of a sweep in <folder_path>/<file_name>_profile.txt: the rows' mean share of time
+    per phase, followed by the report of every row
+    '''
+    from profiling import format_report, load_profiles
+    paths = sorted(glob.glob(os.path.join(folder_path, glob.escape(file_name) + '_*.profile.json')))
+    if not paths:
+        return
+    profiles = load_profiles(paths)
+    phases = next(iter(profiles.values()))['phases']
+    steps_per_sec = [profile['steps_per_sec'] for profile in profiles.values()]
+    n_clamped = sum(bool(profile.get('estimates_clamped')) for profile in profiles.values())
+    lines = [f'{len(profiles)} rows, {np.mean(steps_per_sec):.0f} steps/s on average, '
+             f'{np.min(steps_per_sec):.0f} in the slowest row'
+             + (f', {n_clamped} rows with clamped phase estimates' if n_clamped else '')]
+    for phase in phases:
+        share = np.mean([profile['phases'][phase]['share'] for profile in profiles.values()])
+        mean_us = np.mean([profile['phases'][phase]['mean_us'] for profile in profiles.values()])
+        lines.append(f'  {phase:<22}{mean_us:>10.2f}us {share:>7.1%}')
+    with open(os.path.join(folder_path, file_name + '_profile.txt'), 'w') as f:
+        f.write('\n'.join(lines) + '\n\n' + format_report(profiles))
+
+
+# Settings of a sweep spec other than its name and grid
+SPEC_DEFAULTS = {'folder': None, 'workers': None, 'n_runs': 60000, 'policy': 'epsilon_greedy', 'format': 'parquet',
+                 'decimation': 1, 'fast': False, 'convergence': None, 'cache': None, 'cache_max_bytes': None, 'trace': False,
+                 'state_encoding': 'bin_low_high', 'learning': 'q_learning', 'learning_options': None,
+                 'adaptive': None, 'profile': False}
+
+
+def validate_spec(spec: dict) -> dict:
+    '''
+    :return: the spec completed with SPEC_DEFAULTS
+    '''
+    unknown = set(spec) - set(SPEC_DEFAULTS) - {'name', 'grid'}
+    if unknown:
+        raise ValueError(f'Unknown sweep settings {sorted(unknown)}')
+    if not spec.get('name'):
+        raise ValueError('A sweep needs a name')
+    missing = [column for column in GRID_COLUMNS if column not in spec.get('grid', {})]
+    if missing:
+        raise ValueError(f'The grid has no values for {missing}')
+    return dict(SPEC_DEFAULTS, **spec)
+
+
+def load_spec(path: str) -> dict:
+    '''
+    Read a sweep spec from a JSON file. It holds the sweep's 'name', used for the output files, a 'grid' with a list of
+    values for every name in training.GRID_COLUMNS, and optionally any of SPEC_DEFAULTS, where 'convergence' holds the
+    keyword arguments of a convergence.ConvergenceMonitor and 'adaptive' those of adaptive_sweep.run_adaptive_sweep
+    (metric, eta and min_steps), which then runs the sweep
+    '''
+    with open(path) as f:
+        return validate_spec(json.load(f))
+
+
+def run_spec(spec: dict):
+    '''
+    Run the sweep of a spec and keep a copy of the spec next to its outputs
+    '''
+    spec = validate_spec(spec)
+    folder_path = spec['folder'] if spec['folder'] is not None else os.path.join('..', 'datasets', spec['name'])
+    os.makedirs(folder_path, exist_ok=True)
+    with open(os.path.join(folder_path, spec['name'] + '_spec.json'), 'w') as f:
+        json.dump(spec, f, indent=2)
+    if spec['adaptive'] is not None:
+        if spec['fast'] or spec['trace'] or spec['profile'] or spec['cache'] is not None:
+            raise ValueError('Adaptive sweeps do not support the fast path, traces, profiling or the cache')
+        from adaptive_sweep import run_adaptive_sweep
+        run_adaptive_sweep(build_grid(spec['grid']), folder_path, spec['name'], n_workers=spec['workers'],
+                           n_runs=spec['n_runs'], policy=spec['policy'], output_format=spec['format'],
+                           decimation=spec['decimation'], convergence=spec['convergence'],
+                           state_encoding=spec['state_encoding'], learning=spec['learning'],
+                           learning_options=spec['learning_options'], **spec['adaptive'])
+        return
+    run_sweep(build_grid(spec['grid']), folder_path, spec['name'], n_workers=spec['workers'], n_runs=spec['n_runs'],
+              policy=spec['policy'], output_format=spec['format'], decimation=spec['decimation'], fast=spec['fast'],
+              convergence=spec['convergence'], cache=spec['cache'], cache_max_bytes=spec['cache_max_bytes'], trace=spec['trace'],
+              state_encoding=spec['state_encoding'], learning=spec['learning'],
+              learning_options=spec['learning_options'], profile=spec['profile'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a grid search headless on all CPU cores')
+    parser.add_argument('file_name', nargs='?', default=None,
+                        help='first part of the output file names, DONT USE NUMBERS IN FILE NAME. Defaults to the name '
+                             'in the config')
+    parser.add_argument('--config', default=None,
+                        help='JSON sweep spec, see load_spec. Without it the grid_parameters of run_training.py are '
+                             'used. Options given here override the spec')
+    parser.add_argument('--folder', default=None, help='output folder, defaults to ../datasets/<file_name>')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--n-runs', type=int, default=None)
+    parser.add_argument('--policy', default=None)
+    parser.add_argument('--format', choices=('parquet', 'csv'), default=None)
+    parser.add_argument('--decimation', type=int, default=None)
+    parser.add_argument('--fast', action='store_true', default=None, help='use the compiled fast path kernel')
+    parser.add_argument('--converge', action='store_true', help='end rows early once their q-table converged')
+    parser.add_argument('--convergence-window', type=int, default=5000)
+    parser.add_argument('--convergence-tolerance', type=float, default=.02)
+    parser.add_argument('--cache', default=None, help='folder of a result cache shared between sweeps')
+    parser.add_argument('--cache-max-gb', type=float, default=None, help='evict the least recently used cached rows '
+                                                                         'above this size')
+    parser.add_argument('--state-encoding', choices=sorted(STATE_ENCODINGS), default=None,
+                        help="the agent's state, see state_encoding.py")
+    parser.add_argument('--learning', choices=sorted(LEARNING_MODES), default=None,
+                        help='learning algorithm, options of the algorithm can be set in a --config file')
+    parser.add_argument('--adaptive', default=None, metavar='METRIC',
+                        help='run a successive halving sweep that scores grid cells on this metric, see '
+                             'adaptive_sweep.ADAPTIVE_METRICS')
+    parser.add_argument('--eta', type=int, default=3, help='reduction factor of an adaptive sweep')
+    parser.add_argument('--min-steps', type=int, default=None, help='steps of the first rung of an adaptive sweep')
+    parser.add_argument('--profile', action='store_true', default=None,
+                        help='time the phases of every row and write a report next to the outputs')
+    parser.add_argument('--trace', action='store_true', default=None,
+                        help='write a binary trace of every step of every row next to the outputs')
+    args = parser.parse_args()
+
+    if args.config is not None:
+        spec = load_spec(args.config)
+    else:
+        from run_training import grid_parameters
+        spec = {'grid': grid_parameters}
+    overrides = {'name': args.file_name, 'folder': args.folder, 'workers': args.workers, 'n_runs': args.n_runs,
+                 'policy': args.policy, 'format': args.format, 'decimation': args.decimation, 'fast': args.fast,
+                 'cache': args.cache, 'trace': args.trace, 'state_encoding': args.state_encoding,
+                 'learning': args.learning, 'profile': args.profile,
+                 'cache_max_bytes': int(args.cache_max_gb * 1e9) if args.cache_max_gb is not None else None}
+    spec.update({key: value for key, value in overrides.items() if value is not None})
+    if args.converge:
+        spec['convergence'] = {'window': args.convergence_window, 'q_tolerance': args.convergence_tolerance}
+    if args.adaptive is not None:
+        spec['adaptive'] = {'metric': args.adaptive, 'eta': args.eta, 'min_steps': args.min_steps}
+    if not spec.get('name'):
+        parser.error('the file_name is required without a config')
+    run_spec(spec)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import numpy as np
+
+
+def _group_stats(count: np.ndarray, total: np.ndarray, squares: np.ndarray) -> dict:
+    '''
+    :return: count, mean and sample variance per group from the count, sum and sum of squares of its values. Groups
+             without values have mean 0, groups with fewer than two values have variance nan
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(count > 0, total / count, 0.0)
+        variance = np.where(count > 1, np.maximum(squares - count * mean ** 2, 0.0) / (count - 1), np.nan)
+    return {'count': count.astype(int), 'mean': mean, 'variance': variance}
+
+
+class TelemetryRecorder:
+    '''
+    Records what happens in the training loop at a fixed cost per step.
+
+    Every step adds to flat Python lists, indexed by state and action, of the number of steps, the sum and the sum of
+    squares of the rewards, and to running sums per action for the cumulative mean reward. Action counts and reward
+    statistics per action and per state are derived from them on demand. Every `decimation` steps the running mean
+    reward per action and the q-value change summed since the previous record are stored in preallocated arrays.
+    '''
+
+    def __init__(self, n_states: int, n_actions: int, n_runs: int, decimation: int = 1):
+        self.n_states = n_states
+        self.n_actions = n_actions
+        self.n_runs = n_runs
+        self.decimation = decimation
+
+        n_cells = n_states * n_actions
+        self._count = [0] * n_cells
+        self._reward_sum = [0.0] * n_cells
+        self._reward_squares = [0.0] * n_cells
+        # running sum and number of nonzero rewards per action, for the cumulative mean reward
+        self._action_reward_sum = [0.0] * n_actions
+        self._action_reward_nonzero = [0] * n_actions
+        self._q_delta_sum = 0.0
+
+        n_records = -(-n_runs // decimation)
+        self.recorded_steps = np.arange(0, n_runs, decimation)
+        self.rewards_cum_mean = np.zeros((n_records, n_actions))
+        self.q_delta = np.zeros(n_records)
+        self._n_recorded = 0
+
+    def record(self, step: int, state: int, action: int, reward: float, q_delta: float):
+        cell = state * self.n_actions + action
+        self._count[cell] += 1
+        self._reward_sum[cell] += reward
+        self._reward_squares[cell] += reward * reward
+        self._action_reward_sum[action] += reward
+        if reward != 0:
+            self._action_reward_nonzero[action] += 1
+        self._q_delta_sum += q_delta
+
+        if step % self.decimation == 0:
+            i = step // self.decimation
+            for a in range(self.n_actions):
+                self.rewards_cum_mean[i, a] = self._action_reward_sum[a] / (self._action_reward_nonzero[a] + 1)
+            self.q_delta[i] = self._q_delta_sum
+            self._q_delta_sum = 0.0
+            self._n_recorded = i + 1
+
+    def _table(self, values: list) -> np.ndarray:
+        return np.array(values, dtype=float).reshape(self.n_states, self.n_actions)
+
+    @property
+    def action_counts(self) -> np.ndarray:
+        return self._table(self._count)
+
+    def summary(self) -> dict:
+        count, total, squares = self._table(self._count), self._table(self._reward_sum), self._table(self._reward_squares)
+        return {'action_counts': count,
+                'reward_by_action': _group_stats(count.sum(axis=0), total.sum(axis=0), squares.sum(axis=0)),
+                'reward_by_state': _group_stats(count.sum(axis=1), total.sum(axis=1), squares.sum(axis=1)),
+                'recorded_steps': self.recorded_steps[:self._n_recorded],
+                'rewards_cum_mean': self.rewards_cum_mean[:self._n_recorded],
+                'q_delta': self.q_delta[:self._n_recorded]}
@@ -0,0 +1,257 @@
+import numpy as np
+import random
+import logging
+import sys
+
+from environment import Stimulus, AgentStatus, EmotionEnv
+from agent import QLambdaAgent, QTableAgent, ReplayQTableAgent, SparseQTableAgent
+from state_encoding import BinLowHigh
+from telemetry import TelemetryRecorder
+from expected_value import expected_values_for_stimuli
+
+# Set up logging
+logger = logging.getLogger(__name__)
+stream_handler = logging.StreamHandler(sys.stdout)
+formatter = logging.Formatter('%(message)s')
+stream_handler.setFormatter(formatter)
+logger.addHandler(stream_handler)
+logger.setLevel(logging.INFO)
+
+N_ACTIONS = 3
+N_STATES = 3
+STIMULUS_INT_MIN = 1
+STIMULUS_INT_MAX = 10
+ACTION_NAMES = ('inaction', 'disengage', 'engage')
+
+# Order of the columns of a grid built by build_grid
+GRID_COLUMNS = ('N_STIMULI', 'STIMULUS_MAX_OCCURRENCE', 'alpha', 'gamma', 'epsilon', 'disengage_benefit',
+                'engage_benefit', 'engage_adaptation', 'SEED', 'PERCENTAGE_RESOLVABLE_STIMULI')
+
+# Learning algorithms by the name used in sweep specs: one-step Q-learning, Q(lambda) and experience replay
+LEARNING_MODES = {'q_learning': QTableAgent, 'q_lambda': QLambdaAgent, 'replay': ReplayQTableAgent}
+
+
+def build_grid(grid_parameters: dict) -> np.ndarray:
+    '''
+    Cartesian product of the grid parameters, one row per parameter combination
+    :param grid_parameters: dict with a list of values for every name in GRID_COLUMNS
+    :return: array of shape (n_rows, len(GRID_COLUMNS))
+    '''
+    grid = np.array(np.meshgrid(*[grid_parameters[column] for column in GRID_COLUMNS]))
+    return grid.reshape(len(GRID_COLUMNS), int(grid.size / len(GRID_COLUMNS))).T
+
+
+def row_parameters(grid_row) -> dict:
+    '''
+    :param grid_row: one row of a grid built by build_grid
+    :return: dict of parameter name to value, with counts and the seed as ints
+    '''
+    parameters = dict(zip(GRID_COLUMNS, grid_row))
+    for column in ('N_STIMULI', 'STIMULUS_MAX_OCCURRENCE', 'SEED'):
+        parameters[column] = int(parameters[column])
+    return parameters
+
+
+def canonical_parameters(parameters: dict) -> dict:
+    '''
+    The grid columns of a row's parameters as plain ints and floats, so equal parameter combinations compare and
+    serialize equally whatever their numeric types
+    '''
+    return {column: int(parameters[column]) if column in ('N_STIMULI', 'STIMULUS_MAX_OCCURRENCE', 'SEED')
+            else float(parameters[column]) for column in GRID_COLUMNS}
+
+
+def make_stimuli(n_stimuli, percentage_resolvable, int_min=STIMULUS_INT_MIN, int_max=STIMULUS_INT_MAX):
+    '''
+    Draw a list of stimuli from the global numpy random state, with probabilities of occurrence summing to 1
+    '''
+    stimuli_list = []
+    resolvable_ids = set(np.random.choice(range(n_stimuli), size=int(n_stimuli * percentage_resolvable), replace=False))
+    for i in range(n_stimuli):
+        id = i
+        emo_intensity = np.random.randint(int_min, int_max + 1)
+        p_occurrence = np.random.uniform(0, 1, 1)
+        stimuli_list.append(Stimulus(id=id, emo_intensity=emo_intensity, p_occurrence=p_occurrence, resolvable=(i in resolvable_ids)))
+
+    p_sum = sum(stimulus.p_occurrence for stimulus in stimuli_list)
+    for stimulus in stimuli_list:
+        stimulus.p_occurrence = stimulus.p_occurrence / p_sum
+    return stimuli_list
+
+
+class TrainingRun:
+    '''
+    One grid row: an EmotionEnv with a QTableAgent trained for n_runs steps.
+
+    Without a seed_sequence, random and np.random are seeded with the row's SEED, as in run_training.py. With a
+    numpy.random.SeedSequence, every random stream of the run is derived from it instead. The running mean rewards and
+    Q-table changes are kept for every `decimation`-th step. With a convergence.ConvergenceMonitor the run ends as soon
+    as the monitor reports convergence. With a trajectory.TrajectoryLogger every step is streamed to its file.
+
+    The agent's state is the bin_low_high state of the current intensity, or the state of a state_encoding encoder.
+    Encoders without a fixed number of states get an agent.SparseQTableAgent and must have a state_records method, which
+    gives the learnedStates output. The per-state outputs always use the bin_low_high states.
+
+    learning selects the learning algorithm in LEARNING_MODES, with learning_options as keyword arguments of its agent.
+    A profiling.PhaseProfiler times the phases of every step.
+    '''
+
+    def __init__(self, parameters: dict, n_runs: int = 60000, policy: str = 'epsilon_greedy',
+                 seed_sequence: np.random.SeedSequence = None, decimation: int = 1, convergence=None, trajectory=None,
+                 state_encoder=None, learning: str = 'q_learning', learning_options: dict = None, profiler=None):
+
+        if not 0 <= parameters['gamma'] <= 1:
+            raise ValueError(f"gamma must be between 0 and 1, got {parameters['gamma']}")
+        self.parameters = parameters
+        self.n_runs = n_runs
+        self.policy = policy
+        self.decay_time = n_runs * .7    # How much of the total run is used for exploring
+        self.decay_factor = parameters['epsilon'] / self.decay_time  # how much epsilon is lowered each step
+
+        if seed_sequence is None:
+            random.seed(parameters['SEED'])
+            np.random.seed(parameters['SEED'])
+            env_rng = None
+        else:
+            python_seed, numpy_seed = seed_sequence.generate_state(2)
+            random.seed(int(python_seed))
+            np.random.seed(int(numpy_seed))
+            env_rng = np.random.default_rng(seed_sequence.spawn(1)[0])
+
+        self.stimuli = make_stimuli(parameters['N_STIMULI'], parameters['PERCENTAGE_RESOLVABLE_STIMULI'])
+        self.agent_status = AgentStatus()
+        self.env = EmotionEnv(engage_benefit=parameters['engage_benefit'],
+                              disengage_benefit=parameters['disengage_benefit'],
+                              engage_adaptation=parameters['engage_adaptation'],
+                              stimulus_max_occurrence=parameters['STIMULUS_MAX_OCCURRENCE'],
+                              stimuli=self.stimuli,
+                              agent_status=self.agent_status,
+                              rng=env_rng,
+                              trajectory=trajectory
+                              )
+        self.stimuli = self.env.stimuli  # the environment's StimulusTable, which reflects replacements
+        self.env.reset()
+
+        self.state_encoder = state_encoder if state_encoder is not None else BinLowHigh()
+        self.learning = learning
+        self.learning_options = dict(learning_options or {})
+        if learning not in LEARNING_MODES:
+            raise ValueError(f'Unknown learning mode {learning}, expected one of {list(LEARNING_MODES)}')
+        if self.state_encoder.n_states is None:
+            if learning != 'q_learning':
+                raise ValueError(f'The {learning} learning mode needs a state encoding with a fixed number of states')
+            self.agent = SparseQTableAgent(N_ACTIONS, alpha=parameters['alpha'], gamma=parameters['gamma'],
+                                           epsilon=parameters['epsilon'])
+        else:
+            options = dict(self.learning_options)
+            if learning == 'replay' and 'rng' not in options:
+                options['rng'] = np.random.default_rng(seed_sequence.spawn(1)[0] if seed_sequence is not None
+                                                       else parameters['SEED'])
+            self.agent = LEARNING_MODES[learning](self.state_encoder.n_states, n_actions=N_ACTIONS,
+                                                  alpha=parameters['alpha'], gamma=parameters['gamma'],
+                                                  epsilon=parameters['epsilon'], **options)
+        if convergence is not None:
+            if convergence.min_steps is None:
+                convergence.min_steps = int(self.decay_time)
+            self.agent.attach_monitor(convergence)
+
+        self.action = 0  # the first action
+        self.state = self.state_encoder.encode(self.env.agent_status)  # the first state
+        self.step_count = 0
+
+        # Record actions and rewards
+        self.telemetry = TelemetryRecorder(N_STATES, N_ACTIONS, n_runs, decimation=decimation)
+        self.trajectory = trajectory
+        self.profiler = profiler
+        if profiler is not None:
+            profiler.instrument(self.env, self.agent)
+
+    def run(self, n_steps: int = None):
+        '''
+        Advance the simulation by n_steps, or until n_runs steps have been taken or the agent converged
+        '''
+        end = self.n_runs if n_steps is None else min(self.n_runs, self.step_count + n_steps)
+        env, agent, telemetry, trajectory = self.env, self.agent, self.telemetry, self.trajectory
+        encode, summary_state = self.state_encoder.encode, self.state_encoder.summary_state
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if self.profiler is not None:
+            self.profiler.start(self.step_count)
+        for i in range(self.step_count, end):
+            next_state, reward, done, info = env.step(self.action)
+            next_state = encode(env.agent_status)
+            q_delta = agent.update(self.state, next_state, self.action, reward)  # how much the qTable changed from the update
+            if debug:
+                logger.debug(f'action: {self.action}, reward: {reward}, step: {i}')
+            state = summary_state(self.state)
+            telemetry.record(i, state, self.action, reward, q_delta)
+            if trajectory is not None:
+                trajectory.log_step(i, state, self.action, reward)
+            self.state = next_state
+            self.action = agent.choose_action(self.state, policy=self.policy)
+            if agent.epsilon > 0.1:  # cap epsilon at .1
+                agent.epsilon -= self.decay_factor
+            self.step_count = i + 1
+            if agent.converged:
+                break
+        if self.profiler is not None:
+            self.profiler.stop(self.step_count)
+
+    @property
+    def finished(self):
+        return self.step_count >= self.n_runs or self.agent.converged
+
+    def results(self) -> dict:
+        '''
+        Outputs of the run. After early termination the traces end at the last recorded step, and
+        parameters['converged_step'] holds the step at which the run converged
+        '''
+        parameters = dict(self.parameters, N_RUNS=self.n_runs, STIMULUS_INT_MIN=STIMULUS_INT_MIN,
+                          STIMULUS_INT_MAX=STIMULUS_INT_MAX, learning=self.learning)
+        for name, value in self.learning_options.items():
+            parameters['learning_' + name] = value
+        if self.agent.monitor is not None:
+            parameters['converged_step'] = self.agent.monitor.converged_step if self.agent.converged else -1
+        telemetry = self.telemetry.summary()
+        results = {'parameters': parameters,
+                   'actionPerIntensity': self.telemetry.action_counts,
+                   'learnedValue': self.agent.qtable.round(decimals=2),
+                   'expectedValue': expected_values_for_stimuli(self.stimuli, self.parameters,
+                                                                horizon=self.n_runs).round(decimals=2),
+                   'RewardsCumMean': telemetry['rewards_cum_mean'],
+                   'qTableUpdateAmount': telemetry['q_delta']}
+        if isinstance(self.agent, SparseQTableAgent):
+            # the state of every row of learnedValue
+            results['learnedStates'] = self.state_encoder.state_records(self.agent.keys)
+        return results
+
+
+def train(parameters: dict, n_runs: int = 60000, policy: str = 'epsilon_greedy',
+          seed_sequence: np.random.SeedSequence = None, decimation: int = 1, convergence=None,
+          trajectory_path: str = None, state_encoder=None, learning: str = 'q_learning',
+          learning_options: dict = None, profile_path: str = None) -> dict:
+    '''
+    :param trajectory_path: stream a record of every step to this file, see trajectory.TrajectoryLogger
+    :param state_encoder: encoder of the agent's state, see state_encoding
+    :param learning: learning algorithm in LEARNING_MODES
+    :param learning_options: keyword arguments of the learning algorithm's agent, such as lambda_ for q_lambda
+    :param profile_path: time the phases of the run and save them to this file, see profiling.PhaseProfiler
+    '''
+    profiler = None
+    if profile_path is not None:
+        from profiling import PhaseProfiler
+        profiler = PhaseProfiler()
+    trajectory = None
+    if trajectory_path is not None:
+        from trajectory import TrajectoryLogger
+        trajectory = TrajectoryLogger(trajectory_path)
+    run = TrainingRun(parameters, n_runs=n_runs, policy=policy, seed_sequence=seed_sequence, decimation=decimation,
+                      convergence=convergence, trajectory=trajectory, state_encoder=state_encoder,
+                      learning=learning, learning_options=learning_options, profiler=profiler)
+    try:
+        run.run()
+    finally:
+        if trajectory is not None:
+            trajectory.close()
+    if profiler is not None:
+        profiler.save(profile_path)
+    return run.results()
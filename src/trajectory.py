@@ -0,0 +1,132 @@
+import queue
+import threading
+
+import numpy as np
+
+# One record per step. stimulus_id, encounters and reappraisals describe the stimulus the action acted on, after the
+# action. replaced_id is the id of the stimulus replaced at the end of the step, -1 if there was none
+TRACE_DTYPE = np.dtype([('step', np.int64), ('state', np.int16), ('action', np.int8), ('reward', np.float64),
+                        ('stimulus_id', np.int64), ('encounters', np.int32), ('reappraisals', np.int32),
+                        ('replaced_id', np.int64)])
+
+TRACE_MAGIC = b'EMOTRACE'
+TRACE_VERSION = 1
+
+
+class TrajectoryLogger:
+    '''
+    Streams a record of every step of a run to a binary file.
+
+    Records are filled in place in a chunk of chunk_size steps. A full chunk is handed to a writer thread through a
+    queue of at most max_chunks chunks, and the writer hands written chunks back for reuse, so memory is bounded by
+    max_chunks + 1 chunks whatever the length of the run. If the writer falls behind, the training loop waits for it.
+
+    EmotionEnv.step fills in the stimulus fields and TrainingRun.run completes the record. Read the file with
+    read_trajectory.
+    '''
+
+    def __init__(self, path: str, chunk_size: int = 65536, max_chunks: int = 4):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.n_records = 0
+        self._file = open(path, 'wb')
+        self._file.write(TRACE_MAGIC + np.uint64(TRACE_VERSION).tobytes())
+        self._full = queue.Queue(maxsize=max_chunks)
+        self._free = queue.Queue()
+        self._error = None
+        self._writer = threading.Thread(target=self._write_chunks, daemon=True)
+        self._writer.start()
+        self._new_chunk()
+
+    def _new_chunk(self):
+        try:
+            self._chunk = self._free.get_nowait()
+        except queue.Empty:
+            self._chunk = np.zeros(self.chunk_size, dtype=TRACE_DTYPE)
+        self._position = 0
+        # field views, so the hot path assigns into plain strided arrays
+        chunk = self._chunk
+        self._step, self._state, self._action, self._reward = (chunk['step'], chunk['state'], chunk['action'],
+                                                               chunk['reward'])
+        self._stimulus_id, self._encounters, self._reappraisals, self._replaced_id = (
+            chunk['stimulus_id'], chunk['encounters'], chunk['reappraisals'], chunk['replaced_id'])
+        self._replaced_id[:] = -1
+
+    def log_stimulus(self, stimulus_id, encounters, reappraisals):
+        i = self._position
+        self._stimulus_id[i] = stimulus_id
+        self._encounters[i] = encounters
+        self._reappraisals[i] = reappraisals
+
+    def log_replacement(self, stimulus_id):
+        self._replaced_id[self._position] = stimulus_id
+
+    def log_step(self, step: int, state: int, action: int, reward: float):
+        '''
+        Complete the record of the current step and move on to the next
+        '''
+        i = self._position
+        self._step[i] = step
+        self._state[i] = state
+        self._action[i] = action
+        self._reward[i] = reward
+        self._position = i + 1
+        self.n_records += 1
+        if self._position == self.chunk_size:
+            self._flush()
+
+    def _flush(self):
+        if self._error is not None:
+            raise self._error
+        self._full.put((self._chunk, self._position))
+        self._new_chunk()
+
+    def _write_chunks(self):
+        while True:
+            item = self._full.get()
+            if item is None:
+                return
+            chunk, length = item
+            try:
+                if self._error is None:
+                    self._file.write(chunk[:length].tobytes())
+            except OSError as error:
+                self._error = error
+            self._free.put(chunk)
+
+    def close(self):
+        '''
+        Write the remaining records and wait for the writer to finish
+        '''
+        if self._file.closed:
+            return
+        if self._position:
+            self._flush()
+        self._full.put(None)
+        self._writer.join()
+        self._file.close()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_trajectory(path: str, mmap: bool = True) -> np.ndarray:
+    '''
+    :return: structured array of TRACE_DTYPE with one record per step, memory mapped unless mmap is False
+    '''
+    header = len(TRACE_MAGIC) + 8
+    with open(path, 'rb') as f:
+        start = f.read(header)
+    if start[:len(TRACE_MAGIC)] != TRACE_MAGIC:
+        raise ValueError(f'{path} is not a trajectory file')
+    version = int(np.frombuffer(start[len(TRACE_MAGIC):], dtype=np.uint64)[0])
+    if version != TRACE_VERSION:
+        raise ValueError(f'Trajectory version {version} is not supported, expected {TRACE_VERSION}')
+    if mmap:
+        return np.memmap(path, dtype=TRACE_DTYPE, mode='r', offset=header)
+    return np.fromfile(path, dtype=TRACE_DTYPE, offset=header)
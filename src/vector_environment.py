@@ -0,0 +1,172 @@
+import numpy as np
+
+
+class VectorEmotionEnv:
+    '''
+    K independent copies of EmotionEnv stepped in lockstep.
+
+    The stimuli of every environment are held as struct-of-arrays of shape (K, N). Slot j of environment k plays the
+    role of EmotionEnv.stimuli[j] together with the appraisal the AgentStatus keeps for it: the appraisal starts as a
+    copy of the stimulus and is reset when refresh_stimuli_list replaces the stimulus with a new id. Environments with
+    fewer stimuli can be padded with p_occurrence 0.
+
+    When a stimulus is replaced its slot gets the new id right away, but the slot's appraisal is only reset at the start
+    of the following step, after the action has been taken on the retired appraisal. This gives the same dynamics as EmotionEnv, where the current appraisal outlives its stimulus by one step.
+    '''
+
+    N_ACTIONS = 3
+
+    def __init__(self,
+                 engage_benefit,
+                 disengage_benefit,
+                 engage_adaptation,
+                 stimulus_max_occurrence,
+                 emo_intensity,
+                 p_occurrence,
+                 resolvable,
+                 n_stimuli=None,
+                 rng=None
+                 ):
+        '''
+        :param engage_benefit: scalar or array of shape (K,)
+        :param disengage_benefit: scalar or array of shape (K,)
+        :param engage_adaptation: scalar or array of shape (K,)
+        :param stimulus_max_occurrence: scalar or array of shape (K,)
+        :param emo_intensity: original stimulus intensities, shape (K, N)
+        :param p_occurrence: probabilities of occurrence, shape (K, N), each row summing to 1
+        :param resolvable: resolvable flags, shape (K, N)
+        :param n_stimuli: unpadded number of stimuli per environment, used to mint replacement ids. Defaults to N
+        :param rng: numpy.random.Generator used for sampling stimuli
+        '''
+        self.original_intensity = np.array(emo_intensity, dtype=float, ndmin=2)
+        self.n_envs, self.n_stimuli = self.original_intensity.shape
+        self.p_occurrence = np.broadcast_to(np.asarray(p_occurrence, dtype=float), self.original_intensity.shape).copy()
+        self.resolvable = np.broadcast_to(np.asarray(resolvable, dtype=bool), self.original_intensity.shape).copy()
+
+        self.engage_benefit = self._per_env(engage_benefit)
+        self.disengage_benefit = self._per_env(disengage_benefit)
+        self.engage_adaptation = self._per_env(engage_adaptation)
+        self.stimulus_max_occurrence = self._per_env(stimulus_max_occurrence)
+        self._id_offset = np.broadcast_to(np.asarray(self.n_stimuli if n_stimuli is None else n_stimuli, dtype=np.int64),
+                                          (self.n_envs,)).copy()
+
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self._cdf = np.cumsum(self.p_occurrence, axis=1)
+        # guard against rounding so every draw lands in the last slot that can occur, not in padding
+        last_slot = self.n_stimuli - 1 - np.argmax(self.p_occurrence[:, ::-1] > 0, axis=1)
+        self._cdf[np.arange(self.n_stimuli) >= last_slot[:, None]] = np.inf
+        self._rows = np.arange(self.n_envs)
+
+        # Appraisals, one per slot
+        self.ids = np.tile(np.arange(self.n_stimuli), (self.n_envs, 1))
+        self.emo_intensity = self.original_intensity.copy()
+        self.encounter_counter = np.zeros((self.n_envs, self.n_stimuli), dtype=np.int64)
+        self.reappraisal_counter = np.zeros((self.n_envs, self.n_stimuli), dtype=np.int64)
+
+        # AgentStatus equivalents
+        self.current_slot = np.zeros(self.n_envs, dtype=np.int64)
+        self.current_id = np.zeros(self.n_envs, dtype=np.int64)
+        self.current_emo_intensity = np.zeros(self.n_envs)
+        self.current_encounter_counter = np.zeros(self.n_envs, dtype=np.int64)
+        self.replacement_stimulus_counter = np.zeros(self.n_envs, dtype=np.int64)
+        self._pending_replacement = np.zeros(self.n_envs, dtype=bool)
+
+    @classmethod
+    def from_stimuli_lists(cls, stimuli_lists, rng=None, **kwargs):
+        '''
+        Build from one list of Stimulus objects per environment. Shorter lists are padded with never occurring slots.
+        '''
+        n_envs = len(stimuli_lists)
+        n_stimuli = max(len(stimuli) for stimuli in stimuli_lists)
+        emo_intensity = np.zeros((n_envs, n_stimuli))
+        p_occurrence = np.zeros((n_envs, n_stimuli))
+        resolvable = np.zeros((n_envs, n_stimuli), dtype=bool)
+        for k, stimuli in enumerate(stimuli_lists):
+            for j, stimulus in enumerate(stimuli):
+                emo_intensity[k, j] = stimulus.emo_intensity
+                p_occurrence[k, j] = np.asarray(stimulus.p_occurrence).item()
+                resolvable[k, j] = stimulus.resolvable
+        return cls(emo_intensity=emo_intensity, p_occurrence=p_occurrence, resolvable=resolvable,
+                   n_stimuli=[len(stimuli) for stimuli in stimuli_lists], rng=rng, **kwargs)
+
+    def _per_env(self, value):
+        return np.broadcast_to(np.asarray(value, dtype=float), (self.n_envs,)).copy()
+
+    def step(self, actions):
+        '''
+        Execute one timestep in every environment
+        :param actions: integer array of shape (K,)
+        :return: state, reward, done, info with state and reward of shape (K,)
+        '''
+        actions = np.asarray(actions)
+        if np.any((actions < 0) | (actions >= self.N_ACTIONS)):
+            raise ValueError(f'Received invalid actions {actions[(actions < 0) | (actions >= self.N_ACTIONS)]} '
+                             f'which are not part of the action space')
+
+        rows, slots = self._rows, self.current_slot
+        intensity = self.current_emo_intensity
+
+        # Disengage
+        disengage = actions == 1
+        intensity = np.where(disengage, intensity - self.disengage_benefit, intensity)
+
+        # Engage
+        engage = actions == 2
+        resolvable = self.resolvable[rows, slots]
+        reappraisals = self.reappraisal_counter[rows, slots]
+        benefit = np.where(resolvable, self.engage_benefit,
+                           self.engage_benefit + reappraisals * self.engage_adaptation)
+        intensity = np.where(engage, intensity - benefit, intensity)
+        adapted = engage & resolvable
+        self.emo_intensity[rows, slots] = np.where(adapted,
+                                                   np.clip(self.emo_intensity[rows, slots] - self.engage_adaptation, 0, 10),
+                                                   self.emo_intensity[rows, slots])
+        self.reappraisal_counter[rows, slots] += engage
+
+        self.current_emo_intensity = np.clip(intensity, 0, 10)
+        reward = 10 - self.current_emo_intensity
+
+        self.reset()
+        self.refresh_stimuli_list()
+        done = np.zeros(self.n_envs, dtype=bool)
+        info = {'stimulus_id': self.current_id.copy(),
+                'encounters': self.current_encounter_counter.copy()}
+
+        return self.get_original_intensity(), reward, done, info
+
+    def reset(self):
+        '''
+        Apply pending stimulus replacements, then sample and appraise one new stimulus per environment
+        '''
+        self._apply_replacements()
+        draws = self.rng.random(self.n_envs)
+        slots = (self._cdf < draws[:, None]).sum(axis=1)
+        self.current_slot = slots
+        self.current_id = self.ids[self._rows, slots]
+        self.encounter_counter[self._rows, slots] += 1
+        self.current_encounter_counter = self.encounter_counter[self._rows, slots]
+        self.current_emo_intensity = self.emo_intensity[self._rows, slots].copy()
+
+    def refresh_stimuli_list(self):
+        '''
+        Replace stimuli that reached stimulus_max_occurrence with a new id. Their appraisals are reset in the next reset
+        '''
+        self._pending_replacement = self.current_encounter_counter == self.stimulus_max_occurrence
+        if not self._pending_replacement.any():
+            return
+        rows = np.flatnonzero(self._pending_replacement)
+        self.ids[rows, self.current_slot[rows]] = self._id_offset[rows] + self.replacement_stimulus_counter[rows]
+        self.replacement_stimulus_counter[rows] += 1
+
+    def _apply_replacements(self):
+        if not self._pending_replacement.any():
+            return
+        rows = np.flatnonzero(self._pending_replacement)
+        slots = self.current_slot[rows]
+        self.emo_intensity[rows, slots] = self.original_intensity[rows, slots]
+        self.encounter_counter[rows, slots] = 0
+        self.reappraisal_counter[rows, slots] = 0
+        self._pending_replacement[:] = False
+
+    def get_original_intensity(self):
+        return self.emo_intensity[self._rows, self.current_slot].copy()
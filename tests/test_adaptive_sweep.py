@@ -0,0 +1,22 @@
+import numpy as np
+
+from adaptive_sweep import action_margin, rank_cells
+
+
+def test_action_margin_is_finite_and_grows_with_disagreement():
+    agree = [np.array([[1., 5., 3.], [0., 0., 0.]]), np.array([[1., 5., 3.2], [0., 0., 0.]])]
+    disagree = [np.array([[1., 5., 3.], [0., 0., 0.]]), np.array([[1., 3., 5.], [0., 0., 0.]])]
+    assert np.isfinite(action_margin(disagree))
+    assert action_margin(disagree) > action_margin(agree)
+    assert action_margin([np.zeros((2, 3))]) == 0.0
+
+
+def test_ranking_follows_the_q_tables():
+    qtables = {0: np.array([[1., 5., 3.]]), 1: np.array([[1., 5., 3.]]),  # wide margin, agreeing seeds
+               2: np.array([[1., 5., 4.9]]), 3: np.array([[1., 5., 4.8]])}  # narrow margin
+    cells = [[0, 1], [2, 3]]
+    assert rank_cells(cells, qtables, action_margin) == [[2, 3], [0, 1]]
+
+    # the seeds of the first cell now disagree on the greedy action
+    qtables[1] = np.array([[1., 3., 5.]])
+    assert rank_cells(cells, qtables, action_margin) == [[0, 1], [2, 3]]
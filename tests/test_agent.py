@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from agent import QLambdaAgent, ReplayQTableAgent
+from snapshot import load_snapshot, restore, save_snapshot, take_snapshot
+from training import TrainingRun
+
+PARAMETERS = {'N_STIMULI': 50, 'STIMULUS_MAX_OCCURRENCE': 5, 'alpha': .1, 'gamma': .99, 'epsilon': 1,
+              'disengage_benefit': 2, 'engage_benefit': 2, 'engage_adaptation': 2, 'SEED': 123,
+              'PERCENTAGE_RESOLVABLE_STIMULI': .5}
+
+
+class FixedRng:
+    '''
+    Stands in for a numpy Generator that draws a fixed replay batch
+    '''
+
+    def __init__(self, batch):
+        self.batch = np.array(batch)
+
+    def integers(self, low, high, size):
+        return self.batch[:size]
+
+
+def test_q_lambda_backup_follows_traces_and_cuts_them_after_exploration():
+    agent = QLambdaAgent(2, 2, alpha=.5, gamma=.9, epsilon=.1, lambda_=.8)
+
+    # first backup: only (0, 0) is traced
+    assert agent.update(0, 1, 0, 1) == pytest.approx(.5)
+    np.testing.assert_allclose(agent.qtable, [[.5, 0], [0, 0]])
+
+    # greedy action: the trace of (0, 0) decays to gamma * lambda_ = .72 and shares the error 2 + .9 * .5
+    assert agent.update(1, 0, 1, 2) == pytest.approx(.5 * 2.45 * (1 + .72))
+    np.testing.assert_allclose(agent.qtable, [[.5 + .5 * 2.45 * .72, 0], [0, .5 * 2.45]])
+    np.testing.assert_allclose(agent.traces, [[.72, 0], [0, 1]])
+
+    # (0, 1) is not greedy in state 0: the earlier traces are cut and only (0, 1) is backed up
+    before = agent.qtable.copy()
+    assert agent.update(0, 1, 1, 0) == pytest.approx(.5 * .9 * .5 * 2.45)
+    np.testing.assert_allclose(agent.traces, [[0, 1], [0, 0]])
+    np.testing.assert_allclose(agent.qtable, before + [[0, .5 * .9 * .5 * 2.45], [0, 0]])
+
+
+def test_replay_moves_duplicate_cells_to_their_mean_target():
+    agent = ReplayQTableAgent(2, 2, alpha=.5, gamma=.9, epsilon=.1, buffer_size=8, batch_size=4,
+                              rng=FixedRng([0, 1, 0, 2]))
+    agent.qtable[:] = [[0, 0], [2, 4]]
+    for state, action, reward, next_state in ((0, 1, 1, 1), (0, 1, 3, 0), (1, 0, 5, 0)):
+        i = agent.n_stored
+        agent.states[i], agent.actions[i], agent.rewards[i], agent.next_states[i] = state, action, reward, next_state
+        agent.n_stored += 1
+
+    change = agent.replay()
+
+    # (0, 1) is drawn three times, with targets 1 + .9 * 4, 3 + .9 * 0 and again 1 + .9 * 4
+    mean_target = (2 * (1 + .9 * 4) + 3) / 3
+    np.testing.assert_allclose(agent.qtable, [[0, .5 * mean_target], [2 + .5 * (5 - 2), 4]])
+    assert change == pytest.approx(.5 * mean_target + .5 * (5 - 2))
+
+
+@pytest.mark.parametrize('learning', ['q_lambda', 'replay'])
+def test_snapshot_round_trip_continues_identically(tmp_path, learning):
+    run = TrainingRun(PARAMETERS, n_runs=2000, seed_sequence=np.random.SeedSequence(1), learning=learning,
+                      learning_options={'batch_size': 8} if learning == 'replay' else None)
+    run.run(1000)
+    path = str(tmp_path / 'run.pkl')
+    save_snapshot(take_snapshot(run), path)
+    run.run()
+
+    restored = restore(load_snapshot(path))
+    assert restored.step_count == 1000
+    restored.run()
+
+    np.testing.assert_array_equal(restored.agent.qtable, run.agent.qtable)
+    for name in type(run.agent).LEARNING_STATE:
+        if name != 'rng':
+            np.testing.assert_array_equal(getattr(restored.agent, name), getattr(run.agent, name))
+    np.testing.assert_array_equal(restored.results()['RewardsCumMean'], run.results()['RewardsCumMean'])
@@ -0,0 +1,30 @@
+import numpy as np
+
+from convergence import ConvergenceMonitor
+from training import TrainingRun
+
+PARAMETERS = {'N_STIMULI': 300, 'STIMULUS_MAX_OCCURRENCE': 5, 'alpha': .1, 'gamma': .9, 'epsilon': 1,
+              'disengage_benefit': 2, 'engage_benefit': 2, 'engage_adaptation': 1, 'SEED': 123,
+              'PERCENTAGE_RESOLVABLE_STIMULI': 1}
+
+
+def test_run_converges_after_exploring():
+    run = TrainingRun(PARAMETERS, n_runs=20000, seed_sequence=np.random.SeedSequence(0),
+                      convergence=ConvergenceMonitor(window=2000))
+    run.run()
+
+    monitor = run.agent.monitor
+    assert monitor.min_steps == run.decay_time
+    assert run.agent.converged
+    assert run.decay_time <= monitor.converged_step < run.n_runs
+    assert run.step_count == monitor.converged_step
+    assert run.agent.epsilon <= .1
+    assert monitor.summary()['q_drift'] <= monitor.q_tolerance
+
+
+def test_drifting_q_table_does_not_converge():
+    monitor = ConvergenceMonitor(window=200, min_steps=0, check_every=10)
+    qtable = np.ones((3, 3))
+    for step in range(2000):
+        qtable[1, 2] += .01  # a steady trend, not noise around a fixed value
+        assert not monitor.observe(.01, qtable)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from environment import AgentStatus, EmotionEnv
+from population import Population, StimulusSchedule
+from training import make_stimuli
+
+
+@pytest.mark.parametrize('stimulus_max_occurrence', [1, 2, 5])
+def test_schedule_and_dynamics_match_emotion_env(stimulus_max_occurrence):
+    np.random.seed(5)
+    stimuli = make_stimuli(40, .5)
+    n_steps = 3000
+    actions = np.random.default_rng(3).integers(0, 3, n_steps)
+
+    env = EmotionEnv(engage_benefit=3, disengage_benefit=2, engage_adaptation=1.5,
+                     stimulus_max_occurrence=stimulus_max_occurrence, stimuli=stimuli, agent_status=AgentStatus(),
+                     rng=np.random.default_rng(11))
+    env.reset()
+    ids, encounters, rewards = [], [], []
+    for action in actions:
+        ids.append(env.agent_status.current_id)
+        encounters.append(env.agent_status.current_encounter_counter)
+        rewards.append(env.step(int(action))[1])
+
+    schedule = StimulusSchedule(stimuli, stimulus_max_occurrence, n_steps, rng=np.random.default_rng(11))
+    np.testing.assert_array_equal(schedule.ids[:n_steps], ids)
+    np.testing.assert_array_equal(schedule.encounters[:n_steps], encounters)
+
+    population = Population(schedule, alpha=.1, gamma=.9, epsilon=1, engage_benefit=3, disengage_benefit=2,
+                            engage_adaptation=1.5)
+    reward_sums = []
+    for action in actions:
+        population.action = np.array([action])
+        population.run(1)
+        reward_sums.append(population._reward_sum.sum())
+    np.testing.assert_allclose(np.diff(reward_sums, prepend=0.0), rewards)
+
+
+def test_decimated_q_delta_sums_the_changes_since_the_previous_record():
+    np.random.seed(5)
+    schedule = StimulusSchedule(make_stimuli(40, .5), 5, 1000, rng=np.random.default_rng(11))
+    parameters = dict(alpha=[.1, .3], gamma=.9, epsilon=1, engage_benefit=3, disengage_benefit=2, engage_adaptation=1)
+    every_step = Population(schedule, **parameters, rng=np.random.default_rng(0))
+    every_step.run()
+    decimated = Population(schedule, **parameters, decimation=10, rng=np.random.default_rng(0))
+    decimated.run()
+
+    cumulative = np.cumsum(every_step.results()['qTableUpdateAmount'], axis=0)[::10]
+    np.testing.assert_allclose(decimated.results()['qTableUpdateAmount'], np.diff(cumulative, axis=0, prepend=0.0))
@@ -0,0 +1,23 @@
+import pytest
+
+from profiling import PHASES, PhaseProfiler
+
+
+def test_slow_samples_do_not_dominate_and_remainders_are_never_negative():
+    profiler = PhaseProfiler(sample_every=10)
+    profiler.wall_seconds, profiler.steps = 1.0, 1000
+    for phase in PHASES:
+        profiler.calls[phase] = 1000
+        # reset and refresh_stimuli_list are called within step
+        profiler.durations[phase] = [2e-5 if phase in ('reset', 'refresh_stimuli_list') else 1e-4] * 99
+    profiler.durations['update'].append(1.0)  # one sample interrupted by the system
+
+    summary = profiler.summary()
+    assert summary['phases']['update']['mean_us'] == pytest.approx(100)
+    assert not summary['estimates_clamped']
+    assert summary['phases']['bookkeeping']['total_seconds'] >= 0
+
+    profiler.wall_seconds = .1  # shorter than the estimated phases
+    summary = profiler.summary()
+    assert summary['estimates_clamped']
+    assert summary['phases']['bookkeeping']['total_seconds'] == 0
@@ -0,0 +1,18 @@
+import os
+
+import numpy as np
+
+from result_store import ResultStore
+
+
+def test_consolidate_moves_parts_and_removes_the_pending_folder(tmp_path):
+    store = ResultStore(str(tmp_path / 'sweep.parquet'))
+    for row in range(2):
+        store.append(row, {'parameters': {'alpha': .1 * (row + 1)}, 'learnedValue': np.full((3, 3), row)})
+    assert os.path.isdir(store.pending_path)
+
+    store.consolidate()
+
+    assert not os.path.exists(store.pending_path)
+    assert store.finished_rows() == {0, 1}
+    assert len(store.read(kinds=['learnedValue'])) == 6